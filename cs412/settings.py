@@ -160,6 +160,29 @@ if socket.gethostname() == CS_DEPLOYMENT_HOSTNAME:
     MEDIA_URL = '/ashtosh/media/'
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # shared by every worker process and management command, so that voter_analytics
+    # can invalidate its cached values when voters are imported
+    'voter_analytics': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache',
+        # values of earlier import generations are never read again, so let them expire after a week
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        # every voter filter combination caches a few values per import generation,
+        # so keep room for them instead of culling at the default of 300 files
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+
+# engine answering the voter_analytics graphs: 'sql' runs grouped queries, 'numpy' keeps
+# a columnar copy of the voters in each worker's memory (requires numpy to be installed)
+VOTER_ANALYTICS_ENGINE = 'sql'
+
+
 REST_FRAMEWORK = {
   'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
   'PAGE_SIZE': 10
@@ -11,4 +11,5 @@ admin.site.register(Post)    #registering Post model
 admin.site.register(Photo)   #registering Photo model
 admin.site.register(Follow)  #registering Follow model
 admin.site.register(Comment) #registering Comment model
-admin.site.register(Like)    #registering Like model
\ No newline at end of file
+admin.site.register(Like)    #registering Like model
+admin.site.register(FeedItem) #registering FeedItem model
\ No newline at end of file
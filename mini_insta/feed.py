@@ -0,0 +1,122 @@
+# file: mini_insta/feed.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: loads everything the feed shows about a page of posts in a fixed number of queries
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+import json
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Photo, Comment, Like, FeedItem, likes_display_text
+
+# number of posts on each page of the feed
+FEED_PAGE_SIZE = 20
+
+# number of most recent comments shown under each post of the feed
+COMMENT_PREVIEW_SIZE = 3
+
+
+def encode_cursor(feed_item):
+    '''Encode the (timestamp, id) position of the last FeedItem on a page as an opaque query string value'''
+    position = [feed_item.timestamp.isoformat(), feed_item.pk]
+    return urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    '''Decode a cursor made by encode_cursor into (timestamp, id), returning None if it is missing or malformed'''
+    try:
+        position = json.loads(urlsafe_b64decode(cursor.encode('ascii')))
+        if not (isinstance(position, list) and len(position) == 2
+                and type(position[0]) is str and type(position[1]) is int):
+            return None
+        return datetime.fromisoformat(position[0]), position[1]
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def load_feed_posts(posts):
+    '''Attach what show_feed.html displays to each of the posts (a list or queryset of one page):
+    first_photo, first_liker, likes_display_text and comment_preview (the like and comment counts
+    are columns of Post). Takes three queries whatever the number of posts, instead of about ten per post.'''
+    posts = list(posts)
+    post_ids = [post.pk for post in posts]
+
+    # the first photo of every post (Post.get_all_photos().first() is the lowest pk)
+    first_photos = {}
+    for photo in Photo.objects.filter(post_id__in=post_ids).order_by('pk'):
+        first_photos.setdefault(photo.post_id, photo)
+
+    # the first like of every liked post with its liker
+    first_likes = {}
+    likes = (Like.objects
+             .filter(post_id__in=[post.pk for post in posts if post.like_count])
+             .select_related('profile')
+             .annotate(position=Window(RowNumber(), partition_by=F('post_id'), order_by=F('pk').asc()))
+             .filter(position=1))
+    for like in likes:
+        first_likes[like.post_id] = like
+
+    # the most recent comments of every commented post with their commenters
+    previews = {}
+    comments = (Comment.objects
+                .filter(post_id__in=[post.pk for post in posts if post.comment_count])
+                .select_related('profile')
+                .annotate(
+                    position=Window(RowNumber(), partition_by=F('post_id'), order_by=[F('timestamp').desc(), F('pk').desc()]),
+                )
+                .filter(position__lte=COMMENT_PREVIEW_SIZE)
+                .order_by('post_id', 'position'))
+    for comment in comments:
+        previews.setdefault(comment.post_id, []).append(comment)
+
+    for post in posts:
+        post.first_photo = first_photos.get(post.pk)
+
+        like = first_likes.get(post.pk)
+        post.first_liker = like.profile if like else None
+        post.likes_display_text = likes_display_text(post.like_count if like else 0, post.first_liker)
+
+        post.comment_preview = previews.get(post.pk, [])
+
+    return posts
+
+
+def load_feed_page(profile, cursor=None, size=FEED_PAGE_SIZE):
+    '''Return (posts, next_cursor) for the page of the profile's feed after the cursor (the first page if None),
+    with the posts loaded by load_feed_posts. next_cursor is None on the last page.
+    The page is one seek into the FeedItem (profile, -timestamp, -id) index, however deep it is.'''
+    items = (FeedItem.objects
+             .filter(profile=profile)
+             .select_related('post__profile')
+             .order_by('-timestamp', '-id'))
+
+    # seek past the last item of the previous page; the range on timestamp uses the index,
+    # and the items sharing the cursor's timestamp are left out by id
+    position = decode_cursor(cursor or '')
+    if position:
+        timestamp, pk = position
+        items = items.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, id__gte=pk)
+
+    # fetch one extra item to know whether there is a next page
+    items = list(items[:size + 1])
+    next_cursor = encode_cursor(items[size - 1]) if len(items) > size else None
+
+    return load_feed_posts([item.post for item in items[:size]]), next_cursor
+
+
+def feed_post_data(post, request):
+    '''Return the compact JSON-compatible representation of a post loaded by load_feed_posts'''
+    return {
+        'id': post.pk,
+        'author': post.profile.username,
+        'caption': post.caption,
+        'timestamp': post.timestamp.isoformat(),
+        'photo_url': request.build_absolute_uri(post.first_photo.get_image_url()) if post.first_photo else None,
+        'like_count': post.like_count,
+        'comment_count': post.comment_count,
+        'comments': [
+            {'id': comment.pk, 'author': comment.profile.username, 'text': comment.text}
+            for comment in post.comment_preview
+        ],
+    }
@@ -0,0 +1,61 @@
+# file: mini_insta/management/commands/repair_counters.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: management command to recount the like, comment and follow counters of mini_insta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from mini_insta.models import Profile, Post, Follow, Comment, Like
+
+# (model with the counter, counter field, model being counted, its foreign key to the first model)
+COUNTERS = [
+    (Post, 'like_count', Like, 'post'),
+    (Post, 'comment_count', Comment, 'post'),
+    (Profile, 'follower_count', Follow, 'profile'),
+    (Profile, 'following_count', Follow, 'follower_profile'),
+]
+
+
+def count_of(model, field):
+    '''Return a subquery counting the rows of model whose field points at the outer row'''
+    rows = (model.objects
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'))
+    return Coalesce(Subquery(rows), 0)
+
+
+class Command(BaseCommand):
+    '''Compare every denormalized counter with the rows it counts and fix the ones that drifted,
+    e.g. after rows were deleted by a cascade or from the admin, which bypass the views that keep them up to date'''
+
+    help = 'Recount the like, comment, follower and following counters of mini_insta'
+
+    def add_arguments(self, parser):
+        '''Define the command line arguments for this command'''
+        parser.add_argument('--dry-run', action='store_true', help='report the drifted counters without fixing them')
+
+    def handle(self, *args, **options):
+        '''Report and repair every counter'''
+        for model, counter, counted_model, field in COUNTERS:
+            with transaction.atomic():
+                drifted = (model.objects
+                           .annotate(actual=count_of(counted_model, field))
+                           .exclude(**{counter: F('actual')}))
+
+                for row in drifted.values('pk', counter, 'actual')[:10]:
+                    self.stdout.write(f'{model.__name__} {row["pk"]}: {counter} is {row[counter]}, should be {row["actual"]}')
+
+                if options['dry_run']:
+                    fixed = drifted.count()
+                else:
+                    fixed = model.objects.filter(pk__in=drifted.values('pk')).update(**{counter: count_of(counted_model, field)})
+
+            self.stdout.write(f'{model.__name__}.{counter}: {fixed} drifted')
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Counters repaired'))
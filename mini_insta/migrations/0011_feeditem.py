@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_feeds(apps, schema_editor):
+    """Write the posts of every followed profile into its followers' feeds."""
+    Follow = apps.get_model("mini_insta", "Follow")
+    Post = apps.get_model("mini_insta", "Post")
+    FeedItem = apps.get_model("mini_insta", "FeedItem")
+
+    for follow in Follow.objects.all().iterator():
+        posts = Post.objects.filter(profile_id=follow.profile_id)
+        FeedItem.objects.bulk_create(
+            [
+                FeedItem(
+                    profile_id=follow.follower_profile_id,
+                    author_id=follow.profile_id,
+                    post_id=post.pk,
+                    timestamp=post.timestamp,
+                )
+                for post in posts
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_insta", "0010_profile_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FeedItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                (
+                    "author",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="mini_insta.profile",
+                    ),
+                ),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_items",
+                        to="mini_insta.post",
+                    ),
+                ),
+                (
+                    "profile",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_items",
+                        to="mini_insta.profile",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["profile", "-timestamp", "-id"],
+                        name="feeditem_profile_time_idx",
+                    ),
+                    models.Index(
+                        fields=["profile", "author"], name="feeditem_profile_author_idx"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("profile", "post"), name="feeditem_profile_post_unique"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    """Subquery counting the rows of model whose field points at the outer row."""
+    rows = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+def populate_counters(apps, schema_editor):
+    """Fill the new counters from the existing likes, comments and follows."""
+    Profile = apps.get_model("mini_insta", "Profile")
+    Post = apps.get_model("mini_insta", "Post")
+    Follow = apps.get_model("mini_insta", "Follow")
+    Comment = apps.get_model("mini_insta", "Comment")
+    Like = apps.get_model("mini_insta", "Like")
+
+    Post.objects.update(
+        like_count=count_of(Like, "post"),
+        comment_count=count_of(Comment, "post"),
+    )
+    Profile.objects.update(
+        follower_count=count_of(Follow, "profile"),
+        following_count=count_of(Follow, "follower_profile"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_insta", "0011_feeditem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comment_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="like_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="follower_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="following_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:43
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    """Subquery counting the rows of model whose field points at the outer row."""
+    rows = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+def delete_duplicates(model, fields):
+    """Delete every row of model but the first one of each combination of fields."""
+    duplicates = (
+        model.objects.order_by()
+        .values(*fields)
+        .annotate(first=Min("pk"), total=Count("pk"))
+        .filter(total__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        model.objects.filter(**{field: duplicate[field] for field in fields}).exclude(
+            pk=duplicate["first"]
+        ).delete()
+
+
+def remove_duplicate_follows_and_likes(apps, schema_editor):
+    """Keep the oldest of each duplicated Follow and Like, then recount the counters that included them."""
+    Profile = apps.get_model("mini_insta", "Profile")
+    Post = apps.get_model("mini_insta", "Post")
+    Follow = apps.get_model("mini_insta", "Follow")
+    Like = apps.get_model("mini_insta", "Like")
+
+    delete_duplicates(Follow, ["follower_profile", "profile"])
+    delete_duplicates(Like, ["profile", "post"])
+
+    Post.objects.update(like_count=count_of(Like, "post"))
+    Profile.objects.update(
+        follower_count=count_of(Follow, "profile"),
+        following_count=count_of(Follow, "follower_profile"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_insta", "0012_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_follows_and_likes, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="follow",
+            constraint=models.UniqueConstraint(
+                fields=("follower_profile", "profile"),
+                name="follow_follower_profile_unique",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="like",
+            constraint=models.UniqueConstraint(
+                fields=("profile", "post"), name="like_profile_post_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_insta", "0013_follow_like_unique"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="post",
+            name="comment_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="post",
+            name="like_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="profile",
+            name="follower_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="profile",
+            name="following_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -2,12 +2,51 @@
 # author: Ashtosh Bhandari ashtosh@bu.edu
 # description: the file to create models for mini_insta applicaitons 
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.urls import reverse
 from django.contrib.auth.models import User
 
+# number of FeedItems written per bulk insert
+FEED_BATCH_SIZE = 500
+
+def batches(queryset, size=FEED_BATCH_SIZE):
+    '''Yield the rows of a queryset in lists of at most size rows, without loading them all at once'''
+    batch = []
+    for row in queryset.iterator(chunk_size=size):
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def likes_display_text(count, first_liker):
+    '''Return the text shown for the likes of a post, given how many there are and the Profile of the first liker'''
+    if count == 0:
+        return "No likes yet"
+    elif count == 1:
+        return f"Liked by @{first_liker.username}"
+    else:
+        others_count = count - 1
+        others_text = "other" if others_count == 1 else "others"
+        return f"Liked by @{first_liker.username} and {others_count} {others_text}"
+
+class CounterFieldsMixin:
+    '''Mixin for models with denormalized counters; the counters are only changed with F() updates
+    (and reconciled by the repair_counters command), so saving an instance never writes them back'''
+
+    COUNTER_FIELDS = []
+
+    def save(self, *args, **kwargs):
+        '''Save every field except the counters when updating an existing instance'''
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        super().save(*args, **kwargs)
+
 # Create your models here.
-class Profile(models.Model):
+class Profile(CounterFieldsMixin, models.Model):
     '''Encapsulates the data of an indiviual user'''
 
     #define the data attributes of Profile model
@@ -17,6 +56,10 @@ class Profile(models.Model):
     profile_image_url = models.TextField(blank=True)
     bio_text = models.TextField(blank=True)
     join_date = models.DateTimeField(auto_now=True)
+    follower_count = models.IntegerField(default=0, editable=False) #number of Follows of this profile
+    following_count = models.IntegerField(default=0, editable=False) #number of Follows by this profile
+
+    COUNTER_FIELDS = ['follower_count', 'following_count']
 
     def __str__(self):
         '''retrun a string representation of this (Profile) model instance'''
@@ -46,7 +89,7 @@ class Profile(models.Model):
 
     def get_num_followers(self):
         '''Return the count of followers'''
-        return Follow.objects.filter(profile=self).count()
+        return self.follower_count
 
     def get_following(self):
         '''Return a list of those Profiles followed by this profile'''
@@ -61,33 +104,83 @@ class Profile(models.Model):
 
     def get_num_following(self):
         '''Return the count of how many profiles are being followed'''
-        return Follow.objects.filter(follower_profile=self).count()
+        return self.following_count
 
     def get_post_feed(self):
-        '''Return a QuerySet of Posts from profiles this user is following, ordered by most recent first'''
-
-        # Get all profiles that this profile is following
-        following = Follow.objects.filter(follower_profile=self)
-
-        # Extract the profile IDs from the Follow objects
-        following_profile_ids = []
-
-        for follow in following:
-            following_profile_ids.append(follow.profile.id)
-        
-        # Get all posts from those profiles, ordered by most recent first
-        posts = Post.objects.filter(profile__id__in=following_profile_ids).order_by('-timestamp')
-
-        return posts
-
-
-class Post(models.Model):
+        '''Return a QuerySet of Posts from profiles this user is following, ordered by most recent first.
+        The posts come from this profile's FeedItems, so a page of the feed is one range of their index.'''
+        return Post.objects.filter(feed_items__profile=self).order_by('-feed_items__timestamp', '-feed_items__id')
+
+    def add_to_feed(self, profile):
+        '''Copy the posts of a profile this user just followed into this user's feed'''
+        for posts in batches(Post.objects.filter(profile=profile).values_list('pk', 'timestamp')):
+            FeedItem.objects.bulk_create(
+                [FeedItem(profile=self, author=profile, post_id=pk, timestamp=timestamp) for pk, timestamp in posts],
+                ignore_conflicts=True,
+            )
+
+    def remove_from_feed(self, profile):
+        '''Remove the posts of a profile this user no longer follows from this user's feed'''
+        FeedItem.objects.filter(profile=self, author=profile).delete()
+
+    def follow(self, profile):
+        '''Make this profile follow another one if it doesn't already, counting the follow and copying
+        the posts into this profile's feed only when it is new. Returns True if a Follow was created.
+        The insert comes first and the unique constraint decides whether the follow is new, so
+        concurrent requests never read before writing (which SQLite can't upgrade into a write lock).'''
+        try:
+            with transaction.atomic():
+                Follow.objects.create(follower_profile=self, profile=profile)
+
+                Profile.objects.filter(pk=profile.pk).update(follower_count=F('follower_count') + 1)
+                Profile.objects.filter(pk=self.pk).update(following_count=F('following_count') + 1)
+                self.add_to_feed(profile)
+        except IntegrityError:
+            return False
+        return True
+
+    def unfollow(self, profile):
+        '''Make this profile stop following another one, uncounting the follow and removing
+        its posts from this profile's feed. Returns True if a Follow was deleted.'''
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(follower_profile=self, profile=profile).delete()
+            if deleted:
+                Profile.objects.filter(pk=profile.pk).update(follower_count=F('follower_count') - deleted)
+                Profile.objects.filter(pk=self.pk).update(following_count=F('following_count') - deleted)
+            self.remove_from_feed(profile)
+        return bool(deleted)
+
+    def like(self, post):
+        '''Make this profile like a post if it doesn't already, counting the like only when it is new.
+        Returns True if a Like was created; like follow, the unique constraint decides.'''
+        try:
+            with transaction.atomic():
+                Like.objects.create(profile=self, post=post)
+                Post.objects.filter(pk=post.pk).update(like_count=F('like_count') + 1)
+        except IntegrityError:
+            return False
+        return True
+
+    def unlike(self, post):
+        '''Remove this profile's like of a post, uncounting it. Returns True if a Like was deleted.'''
+        with transaction.atomic():
+            deleted, _ = Like.objects.filter(profile=self, post=post).delete()
+            if deleted:
+                Post.objects.filter(pk=post.pk).update(like_count=F('like_count') - deleted)
+        return bool(deleted)
+
+
+class Post(CounterFieldsMixin, models.Model):
     '''Encapsulates the data of a user's post'''
 
     #define the data attributes of Post model
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE) #forein key to indicate the relastionship to the Profile of the creator of this post
     caption = models.TextField(blank=True) #optional text associated with this post
     timestamp = models.DateTimeField(auto_now=True) #time at which this post was created/saved
+    like_count = models.IntegerField(default=0, editable=False) #number of Likes of this post
+    comment_count = models.IntegerField(default=0, editable=False) #number of Comments on this post
+
+    COUNTER_FIELDS = ['like_count', 'comment_count']
 
     def __str__(self):
         '''retrun a string representation of this Post'''
@@ -120,26 +213,33 @@ class Post(models.Model):
 
     def get_likes_count(self):
         '''Returns the count of likes for this Post'''
-        return Like.objects.filter(post=self).count()
+        return self.like_count
 
     def get_likes_display_text(self):
         '''Returns formatted text for displaying likes (e.g., "Liked by @user and 5 others")'''
-        likes = self.get_likes()
-        count = likes.count()
-
-        if count == 0:
-            return "No likes yet"
-        elif count == 1:
-            return f"Liked by @{likes.first().profile.username}"
-        else:
-            others_count = count - 1
-            others_text = "other" if others_count == 1 else "others"
-            return f"Liked by @{likes.first().profile.username} and {others_count} {others_text}"
+        # the counter can be ahead of the Like rows (e.g. after a cascade), so check the first like exists
+        like = self.get_likes().select_related('profile').first() if self.like_count else None
+        if like is None:
+            return likes_display_text(0, None)
+        return likes_display_text(self.like_count, like.profile)
 
     def get_absolute_url(self):
         '''Return the URL to display one instance of this model'''
         return reverse('post_detail', kwargs={'pk':self.pk})
 
+    def add_to_feeds(self):
+        '''Write this Post into the feed of every follower of its author (fan-out on write)'''
+        followers = Follow.objects.filter(profile=self.profile).values_list('follower_profile_id', flat=True)
+        for follower_ids in batches(followers):
+            FeedItem.objects.bulk_create(
+                [FeedItem(profile_id=pk, author=self.profile, post=self, timestamp=self.timestamp) for pk in follower_ids],
+                ignore_conflicts=True,
+            )
+
+    def update_feeds(self):
+        '''Move this Post to its new place in the feeds after it was saved again (its timestamp is auto_now)'''
+        FeedItem.objects.filter(post=self).update(timestamp=self.timestamp)
+
 class Photo(models.Model):
     '''Encapsulates the data for user's Photo for a Post'''
     
@@ -175,6 +275,12 @@ class Follow(models.Model):
     follower_profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="follower_profile") #indicates  which profile is doing the following (i.e., the “subscriber”)
     timestamp = models.DateTimeField(auto_now=True) #the time at which the follower began following the other profile
 
+    class Meta:
+        '''A profile follows another at most once; the unique index also serves the is-following lookups'''
+        constraints = [
+            models.UniqueConstraint(fields=['follower_profile', 'profile'], name='follow_follower_profile_unique'),
+        ]
+
     def __str__(self):
         '''retrun a string representation of the Follow'''
 
@@ -200,6 +306,37 @@ class Like(models.Model):
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="liker_profile") #indicates which Profile liked the post
     timestamp = models.DateTimeField(auto_now=True) #the time at which the Like was created
 
+    class Meta:
+        '''A profile likes a post at most once; the unique index also serves the has-liked lookups'''
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'post'], name='like_profile_post_unique'),
+        ]
+
     def __str__(self):
         '''return a string representation of the Like'''
         return f'{self.profile.username} likes {self.post}'
+
+
+class FeedItem(models.Model):
+    '''Encapsulates one Post in the feed of a Profile that follows its author.
+    Rows are written when the Post is created or its author is followed, so reading a feed
+    never has to look at Follow or search every Post.'''
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="feed_items") #indicates whose feed this Post is in
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="feed_items") #indicates the Post shown in the feed
+    author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="+") #the Profile that made the Post, so unfollowing can remove its posts
+    timestamp = models.DateTimeField() #copy of the Post timestamp, the order of the feed
+
+    class Meta:
+        '''A Post appears once per feed, and feeds are read newest first'''
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'post'], name='feeditem_profile_post_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['profile', '-timestamp', '-id'], name='feeditem_profile_time_idx'),
+            models.Index(fields=['profile', 'author'], name='feeditem_profile_author_idx'),
+        ]
+
+    def __str__(self):
+        '''return a string representation of the FeedItem'''
+        return f'{self.post} in the feed of {self.profile.username}'
@@ -1,6 +1,139 @@
 # file: mini_insta/test.py
 # author: Ashtosh Bhandari ashtosh@bu.edu
 
+from base64 import urlsafe_b64encode
+import json
+
+from django.contrib.auth.models import User
+from django.forms import modelform_factory
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .feed import FEED_PAGE_SIZE
+from .models import Profile, Post, Follow, Like, FeedItem
 
 # Create your tests here.
+
+def make_profile(username):
+    '''Create a Profile and its User'''
+    user = User.objects.create_user(username)
+    return Profile.objects.create(user=user, username=username, display_name=username)
+
+
+class LikeCounterTests(TestCase):
+    '''Check that pages showing likes cope with a like counter that drifted from the Like rows'''
+
+    def setUp(self):
+        '''Create a post whose counter says it has likes that were deleted without updating it'''
+        self.liker = make_profile('liker')
+        self.post = Post.objects.create(profile=make_profile('author'), caption='hello')
+        Like.objects.create(profile=self.liker, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(like_count=2)
+        Like.objects.all().delete()
+        self.post.refresh_from_db()
+
+    def test_display_text_without_likes(self):
+        '''A counter above zero with no Like rows shows no likes'''
+        self.assertEqual(self.post.get_likes_display_text(), 'No likes yet')
+
+    def test_counters_not_editable(self):
+        '''Forms, including the admin's, leave out the counters since saving never writes them'''
+        self.assertFalse({'like_count', 'comment_count'} & set(modelform_factory(Post, fields='__all__')().fields))
+        self.assertFalse({'follower_count', 'following_count'} & set(modelform_factory(Profile, fields='__all__')().fields))
+
+    def test_post_page_without_likes(self):
+        '''The post page renders instead of failing on the missing first liker'''
+        response = self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk}))
+        self.assertEqual(response.status_code, 200)
+
+
+class FollowLikeTests(TestCase):
+    '''Check that following and liking are idempotent and keep the counters and feeds consistent'''
+
+    def setUp(self):
+        '''Create a follower and an author with two posts'''
+        self.follower = make_profile('follower')
+        self.author = make_profile('author')
+        self.posts = [Post.objects.create(profile=self.author, caption=f'post {i}') for i in range(2)]
+
+    def assertFollowState(self, following):
+        '''Check the Follow rows, both counters and the feed against whether the follower follows the author'''
+        self.follower.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(Follow.objects.filter(follower_profile=self.follower, profile=self.author).count(), int(following))
+        self.assertEqual(self.follower.following_count, int(following))
+        self.assertEqual(self.author.follower_count, int(following))
+        self.assertEqual(FeedItem.objects.filter(profile=self.follower).count(), 2 if following else 0)
+
+    def test_repeated_follow_and_unfollow(self):
+        '''Only the first follow and the first unfollow change anything'''
+        self.assertTrue(self.follower.follow(self.author))
+        self.assertFalse(self.follower.follow(self.author))
+        self.assertFollowState(True)
+
+        self.assertTrue(self.follower.unfollow(self.author))
+        self.assertFalse(self.follower.unfollow(self.author))
+        self.assertFollowState(False)
+
+        self.assertTrue(self.follower.follow(self.author))
+        self.assertFollowState(True)
+
+    def test_repeated_like_and_unlike(self):
+        '''Only the first like and the first unlike change anything'''
+        post = self.posts[0]
+        self.assertTrue(self.follower.like(post))
+        self.assertFalse(self.follower.like(post))
+        post.refresh_from_db()
+        self.assertEqual(post.like_count, 1)
+        self.assertEqual(Like.objects.filter(post=post).count(), 1)
+
+        self.assertTrue(self.follower.unlike(post))
+        self.assertFalse(self.follower.unlike(post))
+        post.refresh_from_db()
+        self.assertEqual(post.like_count, 0)
+        self.assertEqual(Like.objects.filter(post=post).count(), 0)
+
+    def test_repeated_requests(self):
+        '''Double-clicking the follow and like links counts them once'''
+        self.client.force_login(self.follower.user)
+        for i in range(2):
+            self.client.get(reverse('follow', kwargs={'pk': self.author.pk}))
+            self.client.get(reverse('like', kwargs={'pk': self.posts[1].pk}))
+        self.assertFollowState(True)
+        self.posts[1].refresh_from_db()
+        self.assertEqual(self.posts[1].like_count, 1)
+
+
+class FeedCursorTests(TestCase):
+    '''Check that the feed pages through posts by cursor, and ignores malformed cursors'''
+
+    def setUp(self):
+        '''Create a follower whose feed holds two and a half pages of posts, all with the same timestamp'''
+        self.follower = make_profile('follower')
+        author = make_profile('author')
+        self.posts = [Post.objects.create(profile=author, caption=f'post {i}') for i in range(FEED_PAGE_SIZE * 5 // 2)]
+        self.follower.follow(author)
+        FeedItem.objects.filter(profile=self.follower).update(timestamp=timezone.now())
+        self.client.force_login(self.follower.user)
+
+    def test_pages_cover_feed_once(self):
+        '''Following next until it is null returns every post exactly once, newest first'''
+        seen = []
+        url = reverse('show_feed_api')
+        while url:
+            data = self.client.get(url).json()
+            seen += [post['id'] for post in data['posts']]
+            url = data['next']
+        self.assertEqual(seen, sorted((post.pk for post in self.posts), reverse=True))
+
+    def test_malformed_cursors(self):
+        '''Cursors of the wrong shape, type or size show the first page'''
+        positions = [['2020-01-01T00:00:00+00:00', 1e400], ['2020-01-01T00:00:00+00:00', '1'],
+                     [1, 1], ['2020-01-01T00:00:00+00:00'], {'id': 1}, ['not a date', 1]]
+        for position in positions:
+            cursor = urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+            for name in ['show_feed', 'show_feed_api']:
+                with self.subTest(position=position, name=name):
+                    response = self.client.get(reverse(name), {'cursor': cursor})
+                    self.assertEqual(response.status_code, 200)
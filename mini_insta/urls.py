@@ -14,6 +14,7 @@ urlpatterns = [
     # URLs for logged-in user's own profile (no pk needed)
     path('profile/', ProfileDetailView.as_view(), name="my_profile"),  # Show logged-in user's profile
     path('profile/feed/', PostFeedListView.as_view(), name="show_feed"),
+    path('profile/feed/api/', PostFeedAPIView.as_view(), name="show_feed_api"),
     path('profile/search/', SearchView.as_view(), name="search"),
     path('profile/update/', UpdateProfileView.as_view(), name="update_profile"),
     path('profile/create_post/', CreatePostView.as_view(), name="create_post"),
@@ -7,8 +7,13 @@ from django.views.generic import ListView, DetailView, CreateView, UpdateView, D
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
+from django.db import transaction
+from django.db.models import F
+from django.http import JsonResponse
 from django.urls import reverse
+from django.views import View
 from .models import Profile, Post, Photo, Follow, Like
+from .feed import load_feed_page, feed_post_data
 from .forms import *
 
 # Create your views here.
@@ -150,6 +155,9 @@ class CreatePostView(AuthenticatedProfileMixin, CreateView):
         # savign post 
         response = super().form_valid(form)
 
+        # write the new post into the feed of every follower
+        self.object.add_to_feeds()
+
         # OLD :create a new Photo for this post only if image_url was provided
         # image_url = self.request.POST.get('image_url')
         # if image_url:
@@ -218,6 +226,12 @@ class UpdatePostView(AuthenticatedProfileMixin, UpdateView):
     form_class = UpdatePostForm
     template_name = "mini_insta/update_post_form.html"
 
+    def form_valid(self, form):
+        '''Save the Post, then move it to its new timestamp in the followers' feeds'''
+        response = super().form_valid(form)
+        self.object.update_feeds()
+        return response
+
     def get_context_data(self, **kwargs):
         '''Add the Post and Profile objects to the context data'''
         context = super().get_context_data(**kwargs)
@@ -245,7 +259,8 @@ class ShowFollowingDetailView(DetailView):
     context_object_name = "profile"
 
 class PostFeedListView(AuthenticatedProfileMixin, DetailView):
-    '''Display the post feed for a profile - shows posts from profiles they follow'''
+    '''Display the post feed for a profile - shows posts from profiles they follow, a page at a time.
+    Each page seeks past the ?cursor of the previous one, so older pages cost the same as the first.'''
 
     model = Profile
     template_name = "mini_insta/show_feed.html"
@@ -259,11 +274,30 @@ class PostFeedListView(AuthenticatedProfileMixin, DetailView):
         '''Add the post feed to the context'''
         context = super().get_context_data(**kwargs)
 
-        # Get the post feed for this profile
-        context['posts'] = self.object.get_post_feed()
+        # Get one page of the post feed for this profile, with the photos, likes and comments
+        # the template shows loaded for the whole page at once
+        context['posts'], context['next_cursor'] = load_feed_page(self.object, self.request.GET.get('cursor'))
+        context['is_first_page'] = not self.request.GET.get('cursor')
 
         return context
 
+class PostFeedAPIView(AuthenticatedProfileMixin, View):
+    '''Return one page of the logged-in user's post feed as JSON, for clients that scroll through it.
+    Pass the next_cursor of a response as ?cursor to get the page after it; it is null on the last page.'''
+
+    # answer 403 rather than redirecting API clients to the login page
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        '''Return the posts of the page and the cursor of the next one'''
+        posts, next_cursor = load_feed_page(self.get_profile(), request.GET.get('cursor'))
+
+        return JsonResponse({
+            'posts': [feed_post_data(post, request) for post in posts],
+            'next_cursor': next_cursor,
+            'next': f"{reverse('show_feed_api')}?cursor={next_cursor}" if next_cursor else None,
+        })
+
 class SearchView(AuthenticatedProfileMixin, ListView):
     '''Display search form and search results for profiles and posts'''
 
@@ -331,10 +365,7 @@ class FollowView(AuthenticatedProfileMixin, TemplateView):
         # Create the Follow relationship if it doesn't already exist
         # and if the user is not trying to follow themselves
         if follower_profile != profile_to_follow:
-            Follow.objects.get_or_create(
-                follower_profile=follower_profile,
-                profile=profile_to_follow
-            )
+            follower_profile.follow(profile_to_follow)
 
         # Redirect back to the profile page
         return redirect('profile', pk=profile_to_follow.pk)
@@ -351,11 +382,8 @@ class DeleteFollowView(AuthenticatedProfileMixin, TemplateView):
         # Get the profile to unfollow (from URL pk parameter)
         profile_to_unfollow = Profile.objects.get(pk=self.kwargs['pk'])
 
-        # Delete the Follow relationship if it exists
-        Follow.objects.filter(
-            follower_profile=follower_profile,
-            profile=profile_to_unfollow
-        ).delete()
+        # Delete the Follow relationship if it exists, along with the unfollowed posts in the feed
+        follower_profile.unfollow(profile_to_unfollow)
 
         # Redirect back to the profile page
         return redirect('profile', pk=profile_to_unfollow.pk)
@@ -375,10 +403,7 @@ class LikeView(AuthenticatedProfileMixin, TemplateView):
         # Create the Like relationship if it doesn't already exist
         # and if the user is not trying to like their own post
         if post.profile != profile:
-            Like.objects.get_or_create(
-                profile=profile,
-                post=post
-            )
+            profile.like(post)
 
         # Redirect back to the post page
         return redirect('post_detail', pk=post.pk)
@@ -395,11 +420,8 @@ class DeleteLikeView(AuthenticatedProfileMixin, TemplateView):
         # Get the post to unlike (from URL pk parameter)
         post = Post.objects.get(pk=self.kwargs['pk'])
 
-        # Delete the Like relationship if it exists
-        Like.objects.filter(
-            profile=profile,
-            post=post
-        ).delete()
+        # Delete the Like relationship if it exists, and stop counting it
+        profile.unlike(post)
 
         # Redirect back to the post page
         return redirect('post_detail', pk=post.pk)
@@ -423,8 +445,11 @@ class CreateCommentView(AuthenticatedProfileMixin, CreateView):
         form.instance.profile = profile
         form.instance.post = post
 
-        # Save the comment
-        return super().form_valid(form)
+        # Save the comment and count it on the post
+        with transaction.atomic():
+            response = super().form_valid(form)
+            Post.objects.filter(pk=post.pk).update(comment_count=F('comment_count') + 1)
+        return response
 
     def get_success_url(self):
         '''Return URL to redirect to after successful comment creation'''
@@ -0,0 +1,137 @@
+# file: voter_analytics/caching.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: cached data for voter_analytics that only changes when voters are imported
+
+from django.core.cache import caches
+from django.db.models import Count, Max, Min, Sum
+from django.utils.connection import ConnectionProxy
+
+from .models import Voter, VoterImport, VoterRollup, ELECTION_FIELDS
+
+# the cache shared by the worker processes and management commands, separate from the project's default cache
+cache = ConnectionProxy(caches, 'voter_analytics')
+
+# cache key of a copy of the VoterImport row as (generation, rollup_generation), so requests don't read it;
+# every other cached value is keyed by the generation
+IMPORT_STATE_KEY = 'voter_analytics:import_state'
+
+
+def cache_import_state(voter_import):
+    '''Store a copy of the VoterImport row just written in the cache'''
+    cache.set(IMPORT_STATE_KEY, (voter_import.generation, voter_import.rollup_generation))
+
+
+def get_import_state():
+    '''Return (generation, rollup_generation) of the VoterImport row.
+    If the cache lost its copy, the row is read again.'''
+    state = cache.get(IMPORT_STATE_KEY)
+    if state is None:
+        voter_import = VoterImport.current()
+        state = (voter_import.generation, voter_import.rollup_generation)
+
+        # add rather than set, so a generation started meanwhile by another process isn't overwritten
+        cache.add(IMPORT_STATE_KEY, state)
+    return state
+
+
+def get_generation():
+    '''Return the current import generation, the time at which voters were last imported'''
+    return get_import_state()[0]
+
+
+def bump_generation():
+    '''Start a new import generation, invalidating everything cached for the previous one'''
+    cache_import_state(VoterImport.start_generation())
+
+
+def mark_rollup_current():
+    '''Record that VoterRollup was just rebuilt from the voters of the current import generation'''
+    cache_import_state(VoterImport.mark_rollup_current())
+
+
+def rollup_is_current():
+    '''Return True if VoterRollup matches the voters of the current import generation.
+    This is decided by the VoterImport row, so losing cache entries never stops the rollup from being used.'''
+    generation, rollup_generation = get_import_state()
+    return rollup_generation == generation
+
+
+def generation_key(name):
+    '''Return the cache key for the named value in the current import generation'''
+    return f'voter_analytics:{name}:{get_generation()}'
+
+
+def compute_facets():
+    '''Query the choices offered by the voter filter forms'''
+    parties = list(Voter.objects.values_list('party_affiliation', flat=True).distinct().order_by('party_affiliation'))
+    bounds = Voter.objects.aggregate(
+        min_year=Min('birth_year'), max_year=Max('birth_year'),
+        min_score=Min('voter_score'), max_score=Max('voter_score'),
+    )
+
+    if bounds['min_year'] is not None:
+        birth_years = range(bounds['min_year'], bounds['max_year'] + 1)
+        voter_scores = range(bounds['min_score'], bounds['max_score'] + 1)
+    else:
+        birth_years = []
+        voter_scores = range(0, 6)
+
+    return {
+        'party_affiliations': parties,
+        'birth_years': birth_years,
+        'voter_scores': voter_scores,
+    }
+
+
+def get_facets():
+    '''Return the filter form choices (parties, birth years and voter scores) as template context,
+    computed once per import generation'''
+    return cache.get_or_set(generation_key('facets'), compute_facets)
+
+
+def compute_precinct_stats():
+    '''Return one dict per precinct with its number of voters, turnout rate (percent) in each election,
+    party mix and voter score distribution, folded from a single grouped query'''
+
+    # the rollup already holds these groups when it is current; the Voter table gives the same answer
+    if rollup_is_current():
+        queryset, total = VoterRollup.objects.all(), Sum('count')
+    else:
+        queryset, total = Voter.objects.all(), Count('id')
+    groups = (queryset
+              .values('precinct_num', 'party_affiliation', 'voter_score', 'participation')
+              .annotate(count=total)
+              .order_by())
+
+    precincts = {}
+    for group in groups:
+        stats = precincts.setdefault(group['precinct_num'], {
+            'precinct': group['precinct_num'],
+            'voters': 0,
+            'turnout': {name: 0 for name in ELECTION_FIELDS},
+            'parties': {},
+            'scores': {},
+        })
+        count = group['count']
+        stats['voters'] += count
+        for bit, name in enumerate(ELECTION_FIELDS):
+            if group['participation'] & (1 << bit):
+                stats['turnout'][name] += count
+        party = group['party_affiliation']
+        stats['parties'][party] = stats['parties'].get(party, 0) + count
+        score = group['voter_score']
+        stats['scores'][score] = stats['scores'].get(score, 0) + count
+
+    # turn the number of voters who participated into a percentage of the precinct
+    for stats in precincts.values():
+        for name, voted in stats['turnout'].items():
+            stats['turnout'][name] = round(100 * voted / stats['voters'], 1)
+        stats['parties'] = dict(sorted(stats['parties'].items(), key=lambda item: -item[1]))
+        stats['scores'] = dict(sorted(stats['scores'].items()))
+
+    return [precincts[precinct] for precinct in sorted(precincts)]
+
+
+def get_precinct_stats():
+    '''Return the per-precinct statistics, computed once per import generation'''
+    return cache.get_or_set(generation_key('precincts'), compute_precinct_stats)
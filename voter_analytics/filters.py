@@ -0,0 +1,159 @@
+# file: voter_analytics/filters.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: the voter filters shared by the voter list, graphs and export views
+
+import hashlib
+
+from django.db.models import Count, Sum
+from django.http import QueryDict
+from django.utils.functional import cached_property
+
+from .caching import cache, generation_key, rollup_is_current
+from .models import Voter, VoterRollup, ELECTION_FIELDS
+from .snapshot import get_snapshot, snapshot_enabled
+
+
+def parse_int(value):
+    '''Return the value of a query parameter as an int, or None if it is empty or not a number'''
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def count_groups(queryset, total):
+    '''Return (year_counts, party_counts, election_counts) from grouped queries on a queryset
+    of Voter or VoterRollup, where total is the aggregate counting the voters of a group'''
+
+    # Count the filtered voters per (birth year, party) in a single grouped query;
+    # the birth year and party graphs are both folded from these groups
+    groups = (queryset
+              .values('birth_year', 'party_affiliation')
+              .annotate(count=total)
+              .order_by())
+
+    year_counts = {}
+    party_counts = {}
+    for group in groups:
+        year_counts[group['birth_year']] = year_counts.get(group['birth_year'], 0) + group['count']
+        party = group['party_affiliation']
+        party_counts[party] = party_counts.get(party, 0) + group['count']
+
+    # Count the filtered voters per participation bitmask (at most 32 groups),
+    # then add each group to every election whose bit it has set
+    elections = {name: 0 for name in ELECTION_FIELDS}
+    patterns = queryset.values('participation').annotate(count=total).order_by()
+    for pattern in patterns:
+        for bit, name in enumerate(ELECTION_FIELDS):
+            if pattern['participation'] & (1 << bit):
+                elections[name] += pattern['count']
+
+    return year_counts, party_counts, elections
+
+
+class VoterFilter:
+    '''The filters of a voter form (party, birth year range, voter score and elections),
+    normalized so that requests asking for the same voters share one canonical key.
+    The filtered queryset is built once, and counts or other results computed from it
+    are cached under the key until the next import.'''
+
+    def __init__(self, params):
+        '''Read the filters from a QueryDict (or dict) of query parameters, ignoring anything else'''
+        self.party = params.get('party_affiliation') or None
+        self.min_year = parse_int(params.get('min_year'))
+        self.max_year = parse_int(params.get('max_year'))
+        self.voter_score = parse_int(params.get('voter_score'))
+
+        # elections are kept in ELECTION_FIELDS order whatever order the parameters came in
+        self.elections = [name for name in ELECTION_FIELDS if params.get(name)]
+
+    @property
+    def values(self):
+        '''Return the filters as keyword arguments, as accepted by VoterSnapshot.graph_counts'''
+        return {
+            'party': self.party,
+            'min_year': self.min_year,
+            'max_year': self.max_year,
+            'voter_score': self.voter_score,
+            'elections': self.elections,
+        }
+
+    def query_string(self):
+        '''Return the filters as a canonical query string, from which an equal VoterFilter can be made'''
+        params = QueryDict(mutable=True)
+        if self.party:
+            params['party_affiliation'] = self.party
+        if self.min_year is not None:
+            params['min_year'] = self.min_year
+        if self.max_year is not None:
+            params['max_year'] = self.max_year
+        if self.voter_score is not None:
+            params['voter_score'] = self.voter_score
+        for name in self.elections:
+            params[name] = 'on'
+        return params.urlencode()
+
+    @cached_property
+    def key(self):
+        '''Return a short digest identifying this set of filters'''
+        canonical = '|'.join(f'{name}={value!r}' for name, value in self.values.items())
+        return hashlib.md5(canonical.encode('utf-8')).hexdigest()
+
+    def apply(self, queryset):
+        '''Apply the filters to a queryset of Voter or VoterRollup, which share these fields'''
+        if self.party:
+            queryset = queryset.filter(party_affiliation=self.party)
+
+        if self.min_year is not None:
+            queryset = queryset.filter(birth_year__gte=self.min_year)
+
+        if self.max_year is not None:
+            queryset = queryset.filter(birth_year__lte=self.max_year)
+
+        if self.voter_score is not None:
+            queryset = queryset.filter(voter_score=self.voter_score)
+
+        # Filter by elections, with a single predicate on the participation bitmask
+        return queryset.voted_in_all(*self.elections)
+
+    @cached_property
+    def queryset(self):
+        '''Return the filtered voters'''
+        return self.apply(Voter.objects.all())
+
+    def cached(self, name, compute):
+        '''Return the named result for this set of filters, calling compute() only
+        the first time it is asked for in the current import generation'''
+        return cache.get_or_set(generation_key(f'{name}:{self.key}'), compute)
+
+    def count(self):
+        '''Return the number of voters matching the filters, counted once per import generation'''
+        return self.cached('count', self.queryset.count)
+
+    def graph_counts(self):
+        '''Return (year_counts, party_counts, election_counts) dicts for the filtered voters,
+        counted once per import generation'''
+        return self.cached('graph_counts', self.compute_graph_counts)
+
+    def compute_graph_counts(self):
+        '''Count the graphs from the in-memory snapshot when the NumPy engine is enabled, otherwise with SQL'''
+        if snapshot_enabled():
+            return get_snapshot().graph_counts(**self.values)
+
+        # every filter of the form is a rollup dimension, so the rollup can answer whenever
+        # it was rebuilt for the current import; otherwise count the voters themselves
+        if rollup_is_current():
+            return count_groups(self.apply(VoterRollup.objects.all()), Sum('count'))
+        return count_groups(self.queryset, Count('id'))
+
+    def selected_context(self):
+        '''Return the filter values as template context, so the form shows what was selected'''
+        context = {
+            'selected_party': self.party or '',
+            'selected_min_year': '' if self.min_year is None else self.min_year,
+            'selected_max_year': '' if self.max_year is None else self.max_year,
+            'selected_voter_score': '' if self.voter_score is None else self.voter_score,
+        }
+        for name in ELECTION_FIELDS:
+            context[f'selected_{name}'] = 'on' if name in self.elections else ''
+        return context
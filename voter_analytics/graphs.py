@@ -0,0 +1,177 @@
+# file: voter_analytics/graphs.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: builds the plotly figures of the graphs page and caches them per set of filters
+
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.http import QueryDict
+
+from .caching import cache, get_facets, get_generation
+from .filters import VoterFilter
+
+# number of rendered graph sets each process keeps, dropping the least recently used
+FIGURE_CACHE_SIZE = 128
+
+# cache key of the query strings of the filter sets being counted, by filter key;
+# each filter set's number of graph requests is kept under this key followed by its filter key
+POPULARITY_KEY = 'voter_analytics:graph_requests'
+
+# number of filter sets whose popularity is tracked
+POPULARITY_SIZE = 1000
+
+
+@lru_cache(maxsize=None)
+def plotlyjs_version():
+    '''Return the version of the plotly.js bundle shipped with the installed plotly package'''
+    from plotly.offline import get_plotlyjs_version
+    return get_plotlyjs_version()
+
+
+def figure_spec(fig):
+    '''Return the JSON-compatible data/layout spec of a plotly figure, for rendering in the browser'''
+    return json.loads(fig.to_json())
+
+
+def build_figures(year_counts, party_counts, elections):
+    '''Build the three graphs from the voter counts, returning their specs as template context.
+    plotly is imported here rather than with this module, so processes that never draw a graph
+    (and every process until it does) don't pay for importing it.'''
+    import plotly.graph_objs as go
+
+    figures = {}
+
+    # Graph 1: Histogram of birth years
+    sorted_years = sorted(year_counts.keys())
+    year_values = [year_counts[year] for year in sorted_years]
+
+    birth_year_fig = go.Figure(data=[
+        go.Bar(x=sorted_years, y=year_values)
+    ])
+    birth_year_fig.update_layout(
+        title='Distribution of Voters by Year of Birth',
+        xaxis_title='Year of Birth',
+        yaxis_title='Number of Voters'
+    )
+    figures['birth_year_graph'] = figure_spec(birth_year_fig)
+
+    # Graph 2: Pie chart of party affiliation
+    party_fig = go.Figure(data=[
+        go.Pie(labels=list(party_counts.keys()), values=list(party_counts.values()))
+    ])
+    party_fig.update_layout(title='Distribution of Voters by Party Affiliation')
+    figures['party_graph'] = figure_spec(party_fig)
+
+    # Graph 3: Histogram of election participation
+    election_fig = go.Figure(data=[
+        go.Bar(x=list(elections.keys()), y=list(elections.values()))
+    ])
+    election_fig.update_layout(
+        title='Voter Participation in Elections',
+        xaxis_title='Election',
+        yaxis_title='Number of Voters'
+    )
+    figures['election_graph'] = figure_spec(election_fig)
+
+    return figures
+
+
+class FigureCache:
+    '''A bounded, thread-safe mapping that evicts the least recently used entry when full'''
+
+    def __init__(self, size):
+        '''Create an empty cache holding at most size entries'''
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''Return the value stored under key, or None, marking it as the most recently used'''
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        '''Store value under key, evicting the least recently used entries past the size limit'''
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        '''Remove every entry'''
+        with self.lock:
+            self.entries.clear()
+
+
+# the rendered graphs of this process, keyed by (import generation, filter key)
+_figures = FigureCache(FIGURE_CACHE_SIZE)
+
+
+def get_figures(voter_filter):
+    '''Return the graph specs for the filters, from this process's LRU cache, then the shared cache
+    (where warm_voter_graphs puts them), building them only if neither has them for this import'''
+    key = (get_generation(), voter_filter.key)
+    figures = _figures.get(key)
+    if figures is None:
+        figures = voter_filter.cached('figures', lambda: build_figures(*voter_filter.graph_counts()))
+        _figures.put(key, figures)
+    return figures
+
+
+def record_graph_request(voter_filter):
+    '''Count one more request for the graphs of these filters, so the most popular can be warmed up.
+    Every filter set has its own counter, so a request only increments a small value;
+    the list of counted filter sets is only rewritten the first time a filter set is graphed.'''
+    key = f'{POPULARITY_KEY}:{voter_filter.key}'
+    try:
+        cache.incr(key)
+        return
+    except ValueError:
+        # no counter yet (or it expired); if another request starts it first, this one is just not counted
+        if not cache.add(key, 1):
+            return
+
+    queries = cache.get(POPULARITY_KEY, {})
+    queries[voter_filter.key] = voter_filter.query_string()
+
+    # forget the least requested filter sets once too many are tracked
+    if len(queries) > 2 * POPULARITY_SIZE:
+        counts = request_counts(queries)
+        keep = sorted(queries, key=lambda filter_key: -counts.get(filter_key, 0))[:POPULARITY_SIZE]
+        cache.delete_many([f'{POPULARITY_KEY}:{filter_key}' for filter_key in queries if filter_key not in keep])
+        queries = {filter_key: queries[filter_key] for filter_key in keep}
+    cache.set(POPULARITY_KEY, queries)
+
+
+def request_counts(queries):
+    '''Return the number of graph requests counted for each filter key of queries'''
+    counters = cache.get_many([f'{POPULARITY_KEY}:{filter_key}' for filter_key in queries])
+    return {key[len(POPULARITY_KEY) + 1:]: count for key, count in counters.items()}
+
+
+def popular_filters(top):
+    '''Return VoterFilters for the unfiltered dashboard followed by the most requested filter sets,
+    top of them in all'''
+    queries = cache.get(POPULARITY_KEY, {})
+    counts = request_counts(queries)
+    ranked = sorted(queries, key=lambda filter_key: -counts.get(filter_key, 0))
+    query_strings = [''] + [queries[filter_key] for filter_key in ranked if queries[filter_key]]
+    return [VoterFilter(QueryDict(query)) for query in query_strings[:top]]
+
+
+def warm_figures(top):
+    '''Build and cache the graphs of the top most popular filter sets for the current import,
+    returning the number of filter sets warmed'''
+    # the filter form choices are on the page too
+    get_facets()
+
+    voter_filters = popular_filters(top)
+    for voter_filter in voter_filters:
+        get_figures(voter_filter)
+    return len(voter_filters)
@@ -0,0 +1,150 @@
+# file: voter_analytics/ingest.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: helpers to parse rows of a voter CSV file into values ready to be inserted as Voter records
+
+import csv
+import hashlib
+import io
+import os
+from datetime import date
+
+# order of the values returned by parse_row, matching the Voter model field names;
+# voter_id always comes first and content_hash always comes last
+VOTER_FIELDS = (
+    'voter_id',
+    'last_name',
+    'first_name',
+    'RA_street_num',
+    'RA_street_name',
+    'RA_apt_num',
+    'RA_zip',
+    'date_of_birth',
+    'birth_year',
+    'date_of_res',
+    'party_affiliation',
+    'precinct_num',
+    'v20state',
+    'v21town',
+    'v21primary',
+    'v22general',
+    'v23town',
+    'participation',
+    'voter_score',
+    'content_hash',
+)
+
+# number of columns expected in every row of the voter CSV file
+NUM_COLUMNS = 17
+
+
+def parse_row(fields):
+    '''Convert the list of fields from one CSV row into a tuple of values ordered like VOTER_FIELDS.
+    Dates are returned as ISO strings so the tuple can be handed to the database as is.
+    Raises ValueError if the row is malformed.'''
+
+    if len(fields) < NUM_COLUMNS:
+        raise ValueError(f'expected {NUM_COLUMNS} columns, found {len(fields)}')
+    if not fields[0]:
+        raise ValueError('missing voter ID')
+
+    date_of_birth = date.fromisoformat(fields[7])
+
+    # a voter participated in an election only if the column is exactly TRUE
+    voted = [fields[i] == 'TRUE' for i in range(11, 16)]
+
+    return (
+        fields[0],
+        fields[1],
+        fields[2],
+        fields[3],
+        fields[4],
+        fields[5],
+        fields[6],
+        date_of_birth.isoformat(),
+        date_of_birth.year,
+        date.fromisoformat(fields[8]).isoformat(),
+        fields[9],
+        fields[10],
+        *voted,
+
+        # bit i is set when the voter participated in election i, like models.participation_mask
+        sum(1 << i for i, participated in enumerate(voted) if participated),
+
+        int(fields[16]),
+
+        row_hash(fields),
+    )
+
+
+def row_hash(fields):
+    '''Return a short digest of the voter's columns (everything but the voter ID),
+    used to tell whether a voter changed between two exports'''
+    content = '\x1f'.join(fields[1:NUM_COLUMNS]).encode('utf-8')
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def iter_rows(f, start=2):
+    '''Read an open voter CSV file (without its header) and yield (line_num, fields, values, error)
+    for every row; values is None and error is set when the row could not be parsed.
+    line_num is the line the row starts on, which counts the newlines inside quoted fields.'''
+
+    # line numbers start at 2 by default since the header was already consumed
+    reader = csv.reader(f)
+    line_num = start
+    for fields in reader:
+        try:
+            yield line_num, fields, parse_row(fields), None
+        except ValueError as e:
+            yield line_num, fields, None, str(e)
+
+        # the next row starts on the line after the last one read so far
+        line_num = start + reader.line_num
+
+
+def split_ranges(filename, chunk_bytes):
+    '''Yield (start, end) byte offsets that cover the voter CSV file after its header,
+    where every range begins and ends on a row boundary.
+    The file is read through to count quotes: a line ending after an odd number of them
+    ends inside a quoted field, so the range is extended until the row is complete.'''
+
+    with open(filename, 'rb') as f:
+        f.readline() # skip the header
+        start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+
+        while start < size:
+            # read ahead by chunk_bytes, then finish reading the line we landed in,
+            # and the lines after it while they are inside a quoted field
+            quotes = f.read(chunk_bytes).count(b'"')
+            while True:
+                line = f.readline()
+                quotes += line.count(b'"')
+                if not line or quotes % 2 == 0:
+                    break
+            end = f.tell()
+
+            yield start, end
+            start = end
+
+
+def parse_range(filename, start, end):
+    '''Parse the rows stored between two line-aligned byte offsets of a voter CSV file.
+    Returns (rows, rejects, num_lines), where rejects holds (line, error, fields) entries
+    whose line numbers are relative to the start of the range.
+    Runs in worker processes, so it must not touch the database.'''
+
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+
+    # read the range like the serial path reads the file opened with newline='',
+    # so quoted fields keep their newlines and other line separators
+    rows = []
+    rejects = []
+    for line_num, fields, values, error in iter_rows(io.StringIO(text, newline=''), start=1):
+        if error:
+            rejects.append((line_num, error, fields))
+        else:
+            rows.append(values)
+
+    return rows, rejects, text.count('\n')
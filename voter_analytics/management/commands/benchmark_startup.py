@@ -0,0 +1,98 @@
+# file: voter_analytics/management/commands/benchmark_startup.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: management command to time how long a fresh worker process takes to load the site
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# the script run by every fresh interpreter; it loads the site like a worker does before its first request
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+stage = sys.argv[1]
+if stage == 'site_eager_plotly':
+    # what every worker paid when voter_analytics.views imported plotly (and numpy with it) at load time
+    import numpy, plotly, plotly.graph_objs, plotly.offline
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+if stage == 'first_graph':
+    from voter_analytics.graphs import build_figures, plotlyjs_version
+    build_figures({1980: 1}, {'D ': 1}, {'v20state': 1})
+    plotlyjs_version()
+print(json.dumps({
+    'ms': (time.perf_counter() - start) * 1000,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+    'plotly_loaded': 'plotly.graph_objs' in sys.modules,
+}))
+'''
+
+# what each stage measures, in the order they are run
+STAGES = {
+    'site': 'django.setup() and loading every URLconf, as a worker does before its first request',
+    'site_eager_plotly': 'the same, importing plotly and numpy up front as voter_analytics.views used to',
+    'first_graph': 'loading the site and then building the voter graphs once, which imports plotly',
+}
+
+
+class Command(BaseCommand):
+    '''Start fresh Python processes that load the whole site, and report the median time and memory
+    each stage took, so changes that slow down worker start-up (e.g. a heavy import in a views module)
+    show up in the numbers. The results are written as JSON.'''
+
+    help = 'Benchmark the cold start of a worker process loading the site'
+
+    def add_arguments(self, parser):
+        '''Define the command line arguments for this command'''
+        parser.add_argument('--repeat', type=int, default=5, help='number of processes started per stage')
+        parser.add_argument('--output', default='startup_benchmark.json', help='path of the JSON results file')
+
+    def handle(self, *args, **options):
+        '''Run every stage --repeat times and write the medians'''
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        results = {
+            'started': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'repeat': options['repeat'],
+            'stages': {},
+        }
+
+        for stage, description in STAGES.items():
+            runs = [self.start_process(stage) for i in range(options['repeat'])]
+            results['stages'][stage] = summary = {
+                'description': description,
+                'ms': round(statistics.median(run['ms'] for run in runs), 1),
+                'max_rss_kb': statistics.median(run['max_rss_kb'] for run in runs),
+                'modules': runs[-1]['modules'],
+                'plotly_loaded': runs[-1]['plotly_loaded'],
+            }
+            self.stdout.write(f'{stage:<18} {summary["ms"]:>8.1f}ms  {summary["max_rss_kb"] / 1024:>7.1f} MB  '
+                              f'{summary["modules"]:>5} modules  plotly loaded: {summary["plotly_loaded"]}')
+
+        site, eager = results['stages']['site'], results['stages']['site_eager_plotly']
+        self.stdout.write(f'Lazy plotly saves {eager["ms"] - site["ms"]:.1f}ms and '
+                          f'{(eager["max_rss_kb"] - site["max_rss_kb"]) / 1024:.1f} MB per worker')
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote results to {options["output"]}'))
+
+    def start_process(self, stage):
+        '''Run the start-up script for one stage in a new interpreter and return its measurements'''
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'cs412.settings'))
+        completed = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, stage], cwd=settings.BASE_DIR,
+                                   env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'The {stage} process failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
@@ -0,0 +1,160 @@
+# file: voter_analytics/management/commands/benchmark_voters.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: management command to time importing and serving synthetic voters at several sizes
+
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from voter_analytics.caching import bump_generation, mark_rollup_current
+from voter_analytics.synthetic import write_voter_csv
+
+# voter counts benchmarked by default
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+# cache used while benchmarking, so the site's own cached pages are left alone
+BENCHMARK_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'voter_analytics': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'voter-benchmark'},
+}
+
+
+def benchmark_pages(num_rows):
+    '''Return (name, url) for every request timed at the given number of voters'''
+    middle_page = max(1, num_rows // 100 // 2)
+    return [
+        ('voter_list', reverse('voters')),
+        ('voter_list_filtered', reverse('voters') + '?party_affiliation=D+&min_year=1950&max_year=1970&v22general=on'),
+        ('voter_list_middle_page', reverse('voters') + f'?page={middle_page}'),
+        ('voter_list_keyset', reverse('voters') + '?paging=keyset&order=last_name'),
+        ('graphs', reverse('graphs')),
+        ('graphs_filtered', reverse('graphs') + '?party_affiliation=R+&v20state=on&v22general=on'),
+        ('export_csv', reverse('voter_export') + '?format=csv'),
+        ('export_ndjson_filtered', reverse('voter_export') + '?format=ndjson&party_affiliation=D+'),
+        ('search', reverse('voter_search_api') + '?q=smi'),
+    ]
+
+
+class Command(BaseCommand):
+    '''For each size, generate a synthetic voter file, import it into a scratch database with
+    load_voters, then time the voter list, graphs, export and search pages through the test client.
+    Each page is timed once right after a new import generation starts (cold) and then --repeat times (warm).
+    The results are written as JSON so runs can be compared to catch regressions.'''
+
+    help = 'Benchmark importing and serving synthetic voters at 10k, 100k and 1M rows'
+
+    def add_arguments(self, parser):
+        '''Define the command line arguments for this command'''
+        parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help='numbers of voters to benchmark')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='number of warm requests timed per page')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='number of processes load_voters uses to parse the files')
+        parser.add_argument('--seed', type=int, default=412, help='seed of the synthetic voters')
+        parser.add_argument('--output', default='voter_benchmark.json', help='path of the JSON results file')
+        parser.add_argument('--workdir', help='directory for the voter files and scratch database '
+                                              '(defaults to a temporary directory that is removed afterwards)')
+
+    def handle(self, *args, **options):
+        '''Run the benchmark for every size and write the results'''
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark creates a scratch SQLite database, so it needs the SQLite backend')
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        workdir = options['workdir'] or tempfile.mkdtemp(prefix='voter-benchmark-')
+        os.makedirs(workdir, exist_ok=True)
+
+        results = {
+            'started': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'engine': getattr(settings, 'VOTER_ANALYTICS_ENGINE', 'sql'),
+            'runs': [],
+        }
+
+        try:
+            for num_rows in options['sizes']:
+                results['runs'].append(self.run_size(num_rows, workdir, options))
+        finally:
+            if not options['workdir']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote results to {options["output"]}'))
+
+    def run_size(self, num_rows, workdir, options):
+        '''Generate, import and serve num_rows voters in a fresh scratch database, returning the timings'''
+        self.stdout.write(f'Benchmarking {num_rows} voters')
+        run = {'rows': num_rows}
+
+        filename = os.path.join(workdir, f'voters-{num_rows}.csv')
+        start = time.perf_counter()
+        write_voter_csv(filename, num_rows, options['seed'])
+        run['generate_seconds'] = round(time.perf_counter() - start, 3)
+
+        # the scratch database is created like the test runner's, in a file so it behaves like the real one
+        test_name = connection.settings_dict['TEST']['NAME']
+        connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, f'benchmark-{num_rows}.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES, ALLOWED_HOSTS=['testserver'], DEBUG=False):
+                start = time.perf_counter()
+                call_command('load_voters', filename, workers=options['workers'],
+                             rejects=os.path.join(workdir, 'rejects.csv'), stdout=io.StringIO())
+                elapsed = time.perf_counter() - start
+                run['load_seconds'] = round(elapsed, 3)
+                run['load_rows_per_second'] = round(num_rows / elapsed)
+
+                run['pages'] = {}
+                for name, url in benchmark_pages(num_rows):
+                    run['pages'][name] = timing = self.time_page(url, options['repeat'])
+                    self.stdout.write(f'  {name:<24} cold {timing["cold_ms"]:>9.1f}ms  '
+                                      f'warm {timing["warm_ms"]:>9.1f}ms  {timing["bytes"]:>11} bytes')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            connection.settings_dict['TEST']['NAME'] = test_name
+
+        self.stdout.write(f'  loaded in {run["load_seconds"]}s ({run["load_rows_per_second"]:,} rows/sec)')
+        return run
+
+    def time_page(self, url, repeat):
+        '''Return the time taken to serve url with nothing cached for it and the median of repeat warm requests'''
+        client = Client()
+
+        def fetch():
+            '''Request the page and read the whole body, returning (milliseconds, bytes)'''
+            start = time.perf_counter()
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} returned {response.status_code}')
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            return (time.perf_counter() - start) * 1000, len(body)
+
+        # start a new import generation, as if the voters were just imported and nothing was cached yet
+        bump_generation()
+        mark_rollup_current()
+        cold_ms, size = fetch()
+        warm = [fetch()[0] for i in range(repeat)]
+        return {'url': url, 'cold_ms': round(cold_ms, 1), 'warm_ms': round(statistics.median(warm), 1), 'bytes': size}
@@ -0,0 +1,30 @@
+# file: voter_analytics/management/commands/build_voter_rollup.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: management command to rebuild the voter rollup table without importing voters
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from voter_analytics.caching import bump_generation, mark_rollup_current
+from voter_analytics.graphs import warm_figures
+from voter_analytics.models import VoterRollup
+
+
+class Command(BaseCommand):
+    '''Recount VoterRollup from the Voter table, e.g. after voters were edited outside of load_voters'''
+
+    help = 'Rebuild the voter rollup table used by the dashboards'
+
+    def handle(self, *args, **options):
+        '''Rebuild the rollup and start a new import generation so cached charts are recomputed,
+        then render the unfiltered dashboard again'''
+        start = time.perf_counter()
+        VoterRollup.rebuild()
+        bump_generation()
+        mark_rollup_current()
+        warm_figures(1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {VoterRollup.objects.count()} rollup rows in {time.perf_counter() - start:.1f}s'
+        ))
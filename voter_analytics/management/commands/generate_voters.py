@@ -0,0 +1,34 @@
+# file: voter_analytics/management/commands/generate_voters.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: management command to write a synthetic voter CSV file for testing and benchmarks
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voter_analytics.synthetic import write_voter_csv
+
+
+class Command(BaseCommand):
+    '''Write a voter CSV file of made-up voters that load_voters can import.
+    Parties, ages, precincts and turnout follow the shape of the Newton voter file,
+    and the same --seed always produces the same file.'''
+
+    help = 'Write a synthetic voter CSV file with the given number of voters'
+
+    def add_arguments(self, parser):
+        '''Define the command line arguments for this command'''
+        parser.add_argument('filename', help='path of the CSV file to write')
+        parser.add_argument('--rows', type=int, default=10000, help='number of voters to generate')
+        parser.add_argument('--seed', type=int, default=412, help='seed of the random generator')
+
+    def handle(self, *args, **options):
+        '''Generate the voters and write them to the file'''
+        if options['rows'] < 0:
+            raise CommandError('--rows must not be negative')
+
+        start = time.perf_counter()
+        write_voter_csv(options['filename'], options['rows'], options['seed'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {options["rows"]} voters to {options["filename"]} in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,344 @@
+# file: voter_analytics/management/commands/load_voters.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: management command to bulk load a voter CSV file into the database
+
+import csv
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+from voter_analytics.caching import bump_generation, mark_rollup_current
+from voter_analytics.graphs import warm_figures
+from voter_analytics.ingest import VOTER_FIELDS, iter_rows, parse_range, split_ranges
+from voter_analytics.models import Voter, VoterRollup
+from voter_analytics.search import rebuild_search_index, update_search_index
+
+# size of the byte range of the CSV file handed to each worker process
+CHUNK_BYTES = 4 * 1024 * 1024
+
+# number of primary keys deleted per DELETE statement, below SQLite's parameter limit
+DELETE_BATCH_SIZE = 900
+
+# largest share of the loaded voters an incremental import deletes without --allow-deletes,
+# so a truncated snapshot can't wipe out the roll
+MAX_DELETE_FRACTION = 0.1
+
+# largest share of the loaded voters an incremental import reindexes one by one; past it,
+# rebuilding the whole search table in one statement is quicker
+MAX_REINDEX_FRACTION = 0.1
+
+
+def insert_sql():
+    '''Return the INSERT statement for one Voter row, with its columns ordered like VOTER_FIELDS'''
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(Voter._meta.get_field(name).column) for name in VOTER_FIELDS)
+    params = ', '.join(['%s'] * len(VOTER_FIELDS))
+    return f'INSERT INTO {qn(Voter._meta.db_table)} ({columns}) VALUES ({params})'
+
+
+def update_sql():
+    '''Return the UPDATE statement for one Voter row; its parameters are the values of
+    VOTER_FIELDS without the leading voter_id, followed by the primary key'''
+    qn = connection.ops.quote_name
+    assignments = ', '.join(f'{qn(Voter._meta.get_field(name).column)} = %s' for name in VOTER_FIELDS[1:])
+    return f'UPDATE {qn(Voter._meta.db_table)} SET {assignments} WHERE {qn(Voter._meta.pk.column)} = %s'
+
+
+class Command(BaseCommand):
+    '''Stream a voter CSV file into the Voter table using batched bulk inserts.
+    Rows are inserted with one executemany per batch rather than bulk_create, since
+    preparing every field of every model instance was most of the load time.
+    With --workers, parsing is spread over a process pool while this process remains
+    the only one writing to the database.
+    With --incremental, the files are treated as a full snapshot of the voter roll: rows are
+    matched to existing voters by voter ID and only new, changed and missing voters are written.
+    Missing voters are only deleted when no row was rejected and they are a small part of the roll,
+    unless --allow-deletes is given.
+    Without --incremental, the secondary indexes are dropped during the load and built at the end.
+    Either way the rollup is rebuilt once at the end, and so is the name/address search table,
+    except that an incremental import reindexes only the voters it changed. An incremental
+    import that changed nothing leaves the rollup, search table and cached pages as they were.'''
+
+    help = 'Load voters from one or more CSV files, inserting them in batches'
+
+    def add_arguments(self, parser):
+        '''Define the command line arguments for this command'''
+        parser.add_argument('filenames', nargs='+', metavar='filename', help='path to a voter CSV file')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='number of voters inserted per transaction')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='number of processes used to parse the files')
+        parser.add_argument('--incremental', action='store_true',
+                            help='update the existing voters to match the files instead of appending')
+        parser.add_argument('--allow-deletes', action='store_true',
+                            help='with --incremental, delete the voters missing from the files even if '
+                                 'rows were rejected or many voters are missing')
+        parser.add_argument('--rejects',
+                            help='path of the CSV file for rows that could not be loaded '
+                                 '(defaults to <first filename>.rejects.csv)')
+
+    def handle(self, *args, **options):
+        '''Read the files, insert the voters and report the throughput'''
+        filenames = options['filenames']
+        batch_size = options['batch_size']
+        workers = options['workers']
+        incremental = options['incremental']
+        rejects_name = options['rejects'] or f'{filenames[0]}.rejects.csv'
+
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
+
+        for filename in filenames:
+            try:
+                open(filename, 'rb').close()
+            except OSError as e:
+                raise CommandError(f'Could not open {filename}: {e}')
+
+        self.sql = insert_sql()
+        self.seen = set()
+        self.counts = dict(inserted=0, updated=0, unchanged=0, deleted=0, duplicates=0)
+        if incremental:
+            self.update_sql = update_sql()
+            self.existing = self.load_existing()
+            self.changed_pks = []
+            self.inserted_ids = []
+
+        start = time.perf_counter()
+        rejected = 0
+
+        with open(rejects_name, 'w', newline='') as rejects_file:
+            rejects = csv.writer(rejects_file)
+            rejects.writerow(['file', 'line', 'error', 'fields'])
+
+            if workers > 1:
+                chunks = self.parse_parallel(filenames, workers)
+            else:
+                chunks = self.parse_serial(filenames, batch_size)
+
+            # updating the secondary indexes row by row was most of a full load,
+            # so they are dropped and built once the rows are in, even if loading fails
+            if not incremental:
+                self.drop_indexes()
+
+            # this process is the single writer, whichever way the rows were parsed;
+            # if writing fails, close the generator so the worker pool shuts down in its own frame
+            try:
+                for rows, rejected_rows in chunks:
+                    for source, line_num, error, fields in rejected_rows:
+                        rejects.writerow([source, line_num, error, ','.join(fields)])
+
+                        # a voter whose row is bad is still on the roll, so it must not be deleted
+                        if incremental and fields:
+                            self.existing.pop(fields[0], None)
+                    rejected += len(rejected_rows)
+
+                    for i in range(0, len(rows), batch_size):
+                        if incremental:
+                            self.apply_changes(rows[i:i + batch_size])
+                        else:
+                            self.write_batch(rows[i:i + batch_size])
+            finally:
+                chunks.close()
+                if not incremental:
+                    self.create_indexes()
+
+        # whatever was not matched by a row of the snapshot is no longer on the roll
+        if incremental:
+            self.delete_missing(rejected, options['allow_deletes'])
+
+        if self.counts['inserted'] or self.counts['updated'] or self.counts['deleted']:
+            # recount the dashboard rollup and reindex the search table,
+            # then drop the facets and other values cached for the previous set of voters
+            VoterRollup.rebuild()
+            if incremental:
+                self.reindex_changed()
+            else:
+                rebuild_search_index()
+            bump_generation()
+            mark_rollup_current()
+
+            # the unfiltered dashboard is the most visited page, so render it for the new voters right away
+            warm_figures(1)
+
+        self.report(rejected, time.perf_counter() - start, rejects_name, workers)
+
+    def parse_serial(self, filenames, batch_size):
+        '''Parse the files one after another in this process, yielding (rows, rejects) every batch_size rows'''
+        batch = []
+        rejected_rows = []
+
+        for filename in filenames:
+            with open(filename, encoding='utf-8', newline='') as f:
+                f.readline() # discard the header
+
+                for line_num, fields, values, error in iter_rows(f):
+                    if error:
+                        rejected_rows.append((filename, line_num, error, fields))
+                        continue
+
+                    batch.append(values)
+                    if len(batch) >= batch_size:
+                        yield batch, rejected_rows
+                        batch = []
+                        rejected_rows = []
+
+        yield batch, rejected_rows
+
+    def parse_parallel(self, filenames, workers):
+        '''Parse line-aligned byte ranges of the files in a pool of worker processes,
+        yielding (rows, rejects) for each range in file order'''
+
+        # ranges of every file share the same pool, so several towns can be parsed at once
+        ranges = ((filename, start, end) for filename in filenames
+                  for start, end in split_ranges(filename, CHUNK_BYTES))
+
+        # number of lines of each file already consumed; the header is line 1
+        lines_before = {filename: 1 for filename in filenames}
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            while True:
+                # keep only a few ranges in flight so parsed rows don't pile up in memory
+                for filename, start, end in islice(ranges, workers * 2 - len(pending)):
+                    pending.append((filename, executor.submit(parse_range, filename, start, end)))
+                if not pending:
+                    break
+
+                filename, future = pending.popleft()
+                rows, rejected_rows, num_lines = future.result()
+                offset = lines_before[filename]
+                yield rows, [(filename, offset + line, error, fields) for line, error, fields in rejected_rows]
+                lines_before[filename] += num_lines
+
+    def drop_indexes(self):
+        '''Drop the indexes of Voter.Meta.indexes; the unique index on voter_id stays to catch repeated voters'''
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for index in Voter._meta.indexes:
+                # IF EXISTS, in case an earlier load was killed before it could build them again
+                cursor.execute(f'DROP INDEX IF EXISTS {qn(index.name)}')
+
+    def create_indexes(self):
+        '''Build the indexes of Voter.Meta.indexes again'''
+        # the schema editor only renders the statements; entering it isn't allowed inside a transaction on SQLite
+        schema_editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for index in Voter._meta.indexes:
+                cursor.execute(str(index.create_sql(Voter, schema_editor)))
+
+    def unique_rows(self, batch):
+        '''Return the rows of the batch whose voter ID was not seen before during this run'''
+        rows = []
+        for values in batch:
+            if values[0] in self.seen:
+                self.counts['duplicates'] += 1
+            else:
+                self.seen.add(values[0])
+                rows.append(values)
+        return rows
+
+    def write_batch(self, batch):
+        '''Insert one batch of parsed rows inside a single transaction'''
+        rows = self.unique_rows(batch)
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(self.sql, rows)
+        except IntegrityError as e:
+            raise CommandError(f'Some voters are already loaded ({e}); use --incremental to refresh them')
+        self.counts['inserted'] += len(rows)
+
+    def load_existing(self):
+        '''Return a dict mapping the voter ID of every loaded voter to its (pk, content_hash)'''
+        voters = Voter.objects.filter(voter_id__isnull=False).values_list('voter_id', 'pk', 'content_hash')
+        return {voter_id: (pk, content_hash) for voter_id, pk, content_hash in voters.iterator(chunk_size=10000)}
+
+    def apply_changes(self, batch):
+        '''Insert the new voters and update the changed voters of one batch inside a single transaction'''
+        inserts = []
+        updates = []
+        for values in self.unique_rows(batch):
+            # popping the voter leaves only the voters missing from the snapshot in self.existing
+            match = self.existing.pop(values[0], None)
+            if match is None:
+                inserts.append(values)
+            elif match[1] != values[-1]:
+                updates.append(values[1:] + (match[0],))
+                self.changed_pks.append(match[0])
+            else:
+                self.counts['unchanged'] += 1
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if inserts:
+                cursor.executemany(self.sql, inserts)
+            if updates:
+                cursor.executemany(self.update_sql, updates)
+
+        self.inserted_ids += [values[0] for values in inserts]
+        self.counts['inserted'] += len(inserts)
+        self.counts['updated'] += len(updates)
+
+    def delete_missing(self, rejected, allow_deletes):
+        '''Delete the voters that were not in the snapshot, including voters loaded without a voter ID.
+        Unless allow_deletes is set, nothing is deleted when rows were rejected (the snapshot may be
+        truncated or damaged) or when more than MAX_DELETE_FRACTION of the voters would go.'''
+        pks = [pk for pk, content_hash in self.existing.values()]
+        without_id = Voter.objects.filter(voter_id__isnull=True)
+        missing = len(pks) + without_id.count()
+        total = Voter.objects.count()
+
+        if not allow_deletes and missing:
+            reason = None
+            if rejected:
+                reason = f'{rejected} rows were rejected'
+            elif missing > MAX_DELETE_FRACTION * total:
+                reason = f'that is more than {MAX_DELETE_FRACTION:.0%} of the {total} voters'
+            if reason:
+                self.stdout.write(self.style.WARNING(
+                    f'Not deleting the {missing} voters missing from the files since {reason}; '
+                    f'check the files and rerun, or pass --allow-deletes'
+                ))
+                return
+
+        self.changed_pks += pks
+        self.changed_pks += without_id.values_list('pk', flat=True)
+        with transaction.atomic():
+            for i in range(0, len(pks), DELETE_BATCH_SIZE):
+                self.counts['deleted'] += Voter.objects.filter(pk__in=pks[i:i + DELETE_BATCH_SIZE]).delete()[0]
+            self.counts['deleted'] += without_id.delete()[0]
+
+    def reindex_changed(self):
+        '''Update the search table for the voters inserted, updated or deleted by an incremental import,
+        or rebuild it when they are too many of the voters'''
+        changed = len(self.changed_pks) + len(self.inserted_ids)
+        if changed > MAX_REINDEX_FRACTION * Voter.objects.count():
+            rebuild_search_index()
+            return
+
+        # inserted voters only got their primary key from the database
+        pks = list(self.changed_pks)
+        for i in range(0, len(self.inserted_ids), DELETE_BATCH_SIZE):
+            voter_ids = self.inserted_ids[i:i + DELETE_BATCH_SIZE]
+            pks += Voter.objects.filter(voter_id__in=voter_ids).values_list('pk', flat=True)
+        update_search_index(pks)
+
+    def report(self, rejected, elapsed, rejects_name, workers):
+        '''Print the changes made and the rows rejected along with the rows/sec achieved'''
+        counts = self.counts
+        processed = counts['inserted'] + counts['updated'] + counts['unchanged']
+        rate = processed / elapsed if elapsed > 0 else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} voters in {elapsed:.1f}s ({rate:,.0f} rows/sec, {workers} worker(s)): '
+            f'{counts["inserted"]} inserted, {counts["updated"]} updated, '
+            f'{counts["unchanged"]} unchanged, {counts["deleted"]} deleted'
+        ))
+        if counts['duplicates']:
+            self.stdout.write(self.style.WARNING(f'Skipped {counts["duplicates"]} rows with a repeated voter ID'))
+        if rejected:
+            self.stdout.write(self.style.WARNING(f'Rejected {rejected} rows, see {rejects_name}'))
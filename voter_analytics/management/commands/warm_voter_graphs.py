@@ -0,0 +1,32 @@
+# file: voter_analytics/management/commands/warm_voter_graphs.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: management command to render the most requested voter graphs ahead of time
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voter_analytics.graphs import warm_figures
+
+
+class Command(BaseCommand):
+    '''Render the graphs of the unfiltered dashboard and the most requested filter sets
+    into the shared cache, so the first visitors after an import don't wait for them'''
+
+    help = 'Precompute the graphs of the most popular voter filter combinations'
+
+    def add_arguments(self, parser):
+        '''Define the command line arguments for this command'''
+        parser.add_argument('--top', type=int, default=20,
+                            help='number of filter combinations to render, including the unfiltered one')
+
+    def handle(self, *args, **options):
+        '''Render and cache the graphs'''
+        if options['top'] < 1:
+            raise CommandError('--top must be at least 1')
+
+        start = time.perf_counter()
+        warmed = warm_figures(options['top'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered graphs for {warmed} filter combinations in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="voter",
+            name="content_hash",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="voter",
+            name="voter_id",
+            field=models.TextField(blank=True, null=True, unique=True),
+        ),
+    ]
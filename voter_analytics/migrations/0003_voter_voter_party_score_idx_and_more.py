@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0002_voter_content_hash_voter_voter_id"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                fields=["party_affiliation", "voter_score"],
+                name="voter_party_score_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                fields=["voter_score", "date_of_birth"], name="voter_score_birth_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(fields=["date_of_birth"], name="voter_birth_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v20state", True)),
+                fields=["date_of_birth"],
+                name="voter_v20state_birth_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v21town", True)),
+                fields=["date_of_birth"],
+                name="voter_v21town_birth_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v21primary", True)),
+                fields=["date_of_birth"],
+                name="voter_v21primary_birth_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v22general", True)),
+                fields=["date_of_birth"],
+                name="voter_v22general_birth_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v23town", True)),
+                fields=["date_of_birth"],
+                name="voter_v23town_birth_idx",
+            ),
+        ),
+    ]
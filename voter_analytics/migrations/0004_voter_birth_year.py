@@ -0,0 +1,104 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:21
+
+from django.db import migrations, models
+from django.db.models.functions import ExtractYear
+
+
+def populate_birth_year(apps, schema_editor):
+    """Fill birth_year for the voters loaded before the column existed."""
+    Voter = apps.get_model("voter_analytics", "Voter")
+    Voter.objects.update(birth_year=ExtractYear("date_of_birth"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0003_voter_voter_party_score_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_score_birth_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_birth_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v20state_birth_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v21town_birth_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v21primary_birth_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v22general_birth_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v23town_birth_idx",
+        ),
+        migrations.AddField(
+            model_name="voter",
+            name="birth_year",
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_birth_year, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                fields=["voter_score", "birth_year"], name="voter_score_byear_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(fields=["birth_year"], name="voter_byear_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v20state", True)),
+                fields=["birth_year"],
+                name="voter_v20state_byear_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v21town", True)),
+                fields=["birth_year"],
+                name="voter_v21town_byear_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v21primary", True)),
+                fields=["birth_year"],
+                name="voter_v21primary_byear_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v22general", True)),
+                fields=["birth_year"],
+                name="voter_v22general_byear_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                condition=models.Q(("v23town", True)),
+                fields=["birth_year"],
+                name="voter_v23town_byear_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:22
+
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+
+ELECTION_FIELDS = ["v20state", "v21town", "v21primary", "v22general", "v23town"]
+
+
+def populate_participation(apps, schema_editor):
+    """Pack the election booleans of the voters loaded before the column existed."""
+    Voter = apps.get_model("voter_analytics", "Voter")
+    bits = [
+        Case(When(**{name: True}, then=Value(1 << i)), default=Value(0))
+        for i, name in enumerate(ELECTION_FIELDS)
+    ]
+    Voter.objects.update(participation=sum(bits[1:], bits[0]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0004_voter_birth_year"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v20state_byear_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v21town_byear_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v21primary_byear_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v22general_byear_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="voter",
+            name="voter_v23town_byear_idx",
+        ),
+        migrations.AddField(
+            model_name="voter",
+            name="participation",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_participation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="voter",
+            index=models.Index(
+                fields=["participation", "birth_year"],
+                name="voter_participation_byear_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0006_voter_name_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VoterRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("party_affiliation", models.TextField()),
+                ("birth_year", models.IntegerField(null=True)),
+                ("voter_score", models.IntegerField()),
+                ("participation", models.IntegerField()),
+                ("precinct_num", models.TextField()),
+                ("count", models.IntegerField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["party_affiliation", "voter_score"],
+                        name="rollup_party_score_idx",
+                    ),
+                    models.Index(
+                        fields=["participation", "birth_year"],
+                        name="rollup_participation_byear_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
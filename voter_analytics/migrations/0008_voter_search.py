@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:02
+
+from django.db import migrations
+
+# the FTS5 table holding the name and address of every voter, with the voter's id as its rowid
+SEARCH_TABLE = "voter_analytics_voter_search"
+
+
+def create_search_index(apps, schema_editor):
+    """Create the FTS5 search table and index the voters already loaded."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    Voter = apps.get_model("voter_analytics", "Voter")
+    qn = schema_editor.quote_name
+
+    def column(name):
+        return qn(Voter._meta.get_field(name).column)
+
+    name = f"{column('first_name')} || ' ' || {column('last_name')}"
+    address = " || ' ' || ".join(
+        column(field)
+        for field in ["RA_street_num", "RA_street_name", "RA_apt_num", "RA_zip"]
+    )
+
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        f"name, address, tokenize='unicode61', prefix='2 3')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, name, address) "
+        f"SELECT {qn(Voter._meta.pk.column)}, {name}, {address} "
+        f"FROM {qn(Voter._meta.db_table)}"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    """Drop the FTS5 search table."""
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0007_voterrollup"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
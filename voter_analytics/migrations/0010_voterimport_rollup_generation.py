@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0009_voterimport"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="voterimport",
+            name="rollup_generation",
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:40
+
+from django.db import migrations
+
+# the FTS5 table holding the name and address of every voter, with the voter's id as its rowid
+SEARCH_TABLE = "voter_analytics_voter_search"
+
+
+def recreate_search_index(prefix):
+    """Return a migration function that recreates the FTS5 search table indexing
+    the given prefix lengths, and indexes the voters already loaded."""
+
+    def recreate(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+
+        Voter = apps.get_model("voter_analytics", "Voter")
+        qn = schema_editor.quote_name
+
+        def column(name):
+            return qn(Voter._meta.get_field(name).column)
+
+        name = f"{column('first_name')} || ' ' || {column('last_name')}"
+        address = " || ' ' || ".join(
+            column(field)
+            for field in ["RA_street_num", "RA_street_name", "RA_apt_num", "RA_zip"]
+        )
+
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            f"name, address, tokenize='unicode61', prefix='{prefix}')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, address) "
+            f"SELECT {qn(Voter._meta.pk.column)}, {name}, {address} "
+            f"FROM {qn(Voter._meta.db_table)}"
+        )
+
+    return recreate
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("voter_analytics", "0010_voterimport_rollup_generation"),
+    ]
+
+    # also index one character prefixes, so a one letter word next to a longer one ("john s") is quick
+    operations = [
+        migrations.RunPython(
+            recreate_search_index("1 2 3"), recreate_search_index("2 3")
+        ),
+    ]
@@ -1,7 +1,46 @@
 # file: voter_analytics/models.py
 # author: Ashtosh Bhandari ashtosh@bu.edu
 # description: the file to create models for voter_analytics applicaitons 
-from django.db import models
+from django.db import connection, models, transaction
+from django.core.management import call_command
+from datetime import date
+import time
+
+# names of the fields recording whether a voter participated in each recent election;
+# election i is also stored as bit i of Voter.participation
+ELECTION_FIELDS = ['v20state', 'v21town', 'v21primary', 'v22general', 'v23town']
+
+def participation_mask(names):
+    '''Return the participation bitmask with the bits of the named elections set'''
+    mask = 0
+    for name in names:
+        mask |= 1 << ELECTION_FIELDS.index(name)
+    return mask
+
+def participation_values(names, require_all=True):
+    '''Return every participation bitmask that includes all (or, if require_all is False, any)
+    of the named elections. There are only 2**len(ELECTION_FIELDS) bitmasks, so filtering with
+    participation__in on this list is a single predicate that an index on participation can serve.'''
+    mask = participation_mask(names)
+    values = range(1 << len(ELECTION_FIELDS))
+    if require_all:
+        return [value for value in values if value & mask == mask]
+    return [value for value in values if value & mask]
+
+
+class VoterQuerySet(models.QuerySet):
+    '''QuerySet with helpers to filter voters by their election participation'''
+
+    def voted_in_all(self, *names):
+        '''Return the voters who participated in every one of the named elections'''
+        if not names:
+            return self
+        return self.filter(participation__in=participation_values(names))
+
+    def voted_in_any(self, *names):
+        '''Return the voters who participated in at least one of the named elections'''
+        return self.filter(participation__in=participation_values(names, require_all=False))
+
 
 # Create your models here.
 class Voter(models.Model):
@@ -18,6 +57,9 @@ class Voter(models.Model):
     date_of_birth = models.DateField()
     date_of_res = models.DateField()
 
+    # year of date_of_birth, stored so that year filters and histograms are plain integer comparisons
+    birth_year = models.IntegerField(null=True, editable=False)
+
     # party related inofrmation about the voter
     party_affiliation = models.TextField()
     precinct_num = models.TextField()
@@ -29,78 +71,120 @@ class Voter(models.Model):
     v22general = models.BooleanField()
     v23town = models.BooleanField()
 
+    # the same participation packed into one integer, one bit per election of ELECTION_FIELDS
+    participation = models.IntegerField(default=0, editable=False)
+
     voter_score = models.IntegerField()
 
+    # the voter ID from the voter file and a digest of the rest of its row,
+    # used to apply a newer export incrementally instead of reloading everything
+    voter_id = models.TextField(null=True, blank=True, unique=True)
+    content_hash = models.TextField(blank=True)
+
+    objects = VoterQuerySet.as_manager()
+
+    class Meta:
+        '''Indexes for the filter combinations offered by the voter list and graphs pages'''
+        indexes = [
+            models.Index(fields=['party_affiliation', 'voter_score'], name='voter_party_score_idx'),
+            models.Index(fields=['voter_score', 'birth_year'], name='voter_score_byear_idx'),
+            models.Index(fields=['birth_year'], name='voter_byear_idx'),
+            models.Index(fields=['participation', 'birth_year'], name='voter_participation_byear_idx'),
+            models.Index(fields=['last_name', 'id'], name='voter_name_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        '''Keep birth_year and participation in sync with the fields they are derived from before saving'''
+        if isinstance(self.date_of_birth, str):
+            self.date_of_birth = date.fromisoformat(self.date_of_birth)
+        self.birth_year = self.date_of_birth.year
+        self.participation = participation_mask(name for name in ELECTION_FIELDS if getattr(self, name))
+        super().save(*args, **kwargs)
+
     def __str__(self):
         '''String representation of a voter'''
         return f'{self.first_name} {self.last_name} lives in {self.RA_street_num} {self.RA_street_name}, Apt {self.RA_apt_num} - affillitated with {self.party_affiliation}'
 
-def load_data():
-    '''Function to loads voter data from CSV file into the Django database.'''
-
-    filename = '/Users/ashto/Downloads/newton_voters.csv'
-    f = open(filename, 'r') #open the file for reading
-
-    #discard headers:
-    f.readline() # do nothing with it
-
-    #read the entire file, one line at a time
-    for line in f:
-
-        
-        fields = line.strip().split(',')
-        
-        try:
-            # setting voter's election partitcipation to all as False
-            voter_v20state = False
-            voter_v21town = False
-            voter_v21primary = False
-            voter_v22general = False
-            voter_v23town = False 
-
-            # checking from CSV fields if the voter participated in the election, if they did then for the respecive election setting
-            # participation as true, else it remains false as they did not participate
-            if fields[11] == "TRUE":
-                voter_v20state = True
-            
-            if fields[12] == "TRUE":
-                voter_v21town = True
-            
-            if fields[13] == "TRUE":
-                voter_v21primary = True
-            
-            if fields[14] == "TRUE":
-                voter_v22general = True
-            
-            if fields[15] == "TRUE":
-                voter_v23town = True
-
-            # create a new instance of Voter object with this record from CSV
-            voter = Voter(
-                last_name = fields[1],
-                first_name = fields[2],
-                RA_street_num = fields[3],
-                RA_street_name = fields[4],
-                RA_apt_num = fields[5],
-                RA_zip = fields[6],
-                date_of_birth = fields[7],
-                date_of_res = fields[8],
-                party_affiliation = fields[9],
-                precinct_num = fields[10],
-                
-                # store the respecitive boolean value for resective election voting participation      
-                v20state = voter_v20state,
-                v21town = voter_v21town,
-                v21primary = voter_v21primary,
-                v22general = voter_v22general,
-                v23town = voter_v23town,
-                
-                voter_score = int(fields[16]) 
-            )
-        
-            voter.save() #commit the voter to the database
-        
-        except Exception as e:
-            print(f"Something went wrong: {e}")
-            print(f"line = {line}")
-            print(f"fields = {fields}")
\ No newline at end of file
+class VoterRollup(models.Model):
+    '''Number of voters for each combination of the dimensions the dashboards filter and group on.
+    Rebuilt after every import, so charts can sum a few thousand rollup rows instead of scanning every voter.'''
+
+    # the dimensions, with the same names and meaning as on Voter
+    party_affiliation = models.TextField()
+    birth_year = models.IntegerField(null=True)
+    voter_score = models.IntegerField()
+    participation = models.IntegerField()
+    precinct_num = models.TextField()
+
+    # number of voters with this combination
+    count = models.IntegerField()
+
+    objects = VoterQuerySet.as_manager()
+
+    class Meta:
+        '''Indexes mirroring the ones on Voter for the same filters'''
+        indexes = [
+            models.Index(fields=['party_affiliation', 'voter_score'], name='rollup_party_score_idx'),
+            models.Index(fields=['participation', 'birth_year'], name='rollup_participation_byear_idx'),
+        ]
+
+    # fields of Voter that make up one rollup row
+    DIMENSIONS = ['party_affiliation', 'birth_year', 'voter_score', 'participation', 'precinct_num']
+
+    def __str__(self):
+        '''String representation of a rollup row'''
+        return f'{self.count} voters: {self.party_affiliation} born {self.birth_year}, score {self.voter_score}, participation {self.participation}, precinct {self.precinct_num}'
+
+    @classmethod
+    def rebuild(cls):
+        '''Replace the rollup rows with fresh counts grouped from the Voter table, in one INSERT ... SELECT'''
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(name) for name in cls.DIMENSIONS)
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {qn(cls._meta.db_table)} ({columns}, {qn("count")}) '
+                    f'SELECT {columns}, COUNT(*) FROM {qn(Voter._meta.db_table)} GROUP BY {columns}'
+                )
+
+class VoterImport(models.Model):
+    '''The current import generation: the time at which voters were last imported or recounted.
+    Every cached voter_analytics value is keyed by it. There is a single row, kept in the database
+    rather than only in the cache so it can't be culled along with the values keyed by it.'''
+
+    generation = models.FloatField()
+
+    # the generation VoterRollup was last rebuilt for; the rollup answers the dashboards only if it is current
+    rollup_generation = models.FloatField(null=True)
+
+    def __str__(self):
+        '''String representation of the import generation'''
+        return f'Import generation {self.generation}'
+
+    @classmethod
+    def current(cls):
+        '''Return the row, starting a generation if voters were never imported'''
+        voter_import, created = cls.objects.get_or_create(pk=1, defaults={'generation': time.time()})
+        return voter_import
+
+    @classmethod
+    def start_generation(cls):
+        '''Record a new import generation and return the updated row'''
+        voter_import, created = cls.objects.update_or_create(pk=1, defaults={'generation': time.time()})
+        return voter_import
+
+    @classmethod
+    def mark_rollup_current(cls):
+        '''Record that VoterRollup was rebuilt for the current generation and return the updated row'''
+        voter_import = cls.current()
+        voter_import.rollup_generation = voter_import.generation
+        voter_import.save(update_fields=['rollup_generation'])
+        return voter_import
+
+def load_data(filename='/Users/ashto/Downloads/newton_voters.csv'):
+    '''Function to loads voter data from CSV file into the Django database.
+    Delegates to the load_voters management command, which inserts the voters in batches.'''
+
+    call_command('load_voters', filename)
@@ -0,0 +1,103 @@
+# file: voter_analytics/search.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: full-text search of voters by name and address, backed by an SQLite FTS5 table
+
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Voter
+
+# the FTS5 table holding the name and address of every voter, with the voter's id as its rowid
+SEARCH_TABLE = 'voter_analytics_voter_search'
+
+# most voters a search returns
+SEARCH_LIMIT = 25
+
+# shortest word a search needs; a single letter matches most of the town,
+# and ranking every one of those matches takes over a second
+SEARCH_MIN_LENGTH = 2
+
+# number of voters reindexed per statement, below SQLite's parameter limit
+SEARCH_BATCH_SIZE = 900
+
+
+def search_available(conn=connection):
+    '''Return True if the database supports the FTS5 search table (SQLite only)'''
+    return conn.vendor == 'sqlite'
+
+
+def search_rows_sql(conn=connection):
+    '''Return the INSERT ... SELECT copying the name and address of the voters into the search table'''
+    qn = conn.ops.quote_name
+    column = lambda name: qn(Voter._meta.get_field(name).column)
+    name = f"{column('first_name')} || ' ' || {column('last_name')}"
+    address = ' || \' \' || '.join(column(field) for field in ['RA_street_num', 'RA_street_name', 'RA_apt_num', 'RA_zip'])
+    return (
+        f'INSERT INTO {SEARCH_TABLE} (rowid, name, address) '
+        f'SELECT {qn(Voter._meta.pk.column)}, {name}, {address} FROM {qn(Voter._meta.db_table)}'
+    )
+
+
+def rebuild_search_index(conn=connection):
+    '''Replace the contents of the search table with the names and addresses of the current voters,
+    in one INSERT ... SELECT'''
+    if not search_available(conn):
+        return
+
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(search_rows_sql(conn))
+
+
+def update_search_index(pks, conn=connection):
+    '''Reindex only the voters with the given primary keys, after an import inserted, updated or
+    deleted them: their rows are dropped from the search table and copied again if the voter still exists'''
+    if not search_available(conn):
+        return
+
+    pks = list(pks)
+    pk_column = conn.ops.quote_name(Voter._meta.pk.column)
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        for i in range(0, len(pks), SEARCH_BATCH_SIZE):
+            batch = pks[i:i + SEARCH_BATCH_SIZE]
+            params = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({params})', batch)
+            cursor.execute(f'{search_rows_sql(conn)} WHERE {pk_column} IN ({params})', batch)
+
+
+def match_expression(query):
+    '''Turn what was typed in the search box into an FTS5 query where every word must match
+    the start of a word in the name or address, e.g. "smi wash" becomes "smi"* "wash"*'''
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def searchable(query):
+    '''Return True if the query has a word of at least SEARCH_MIN_LENGTH characters'''
+    return any(len(word) >= SEARCH_MIN_LENGTH for word in re.findall(r'\w+', query))
+
+
+def search_voters(query, limit=SEARCH_LIMIT):
+    '''Return up to limit voters whose name or address match the query, best matches first'''
+    if not searchable(query):
+        return []
+
+    if not search_available():
+        # without FTS5, fall back to a substring search on the last name and street
+        words = re.findall(r'\w+', query)
+        voters = Voter.objects.all()
+        for word in words:
+            voters = voters.filter(Q(last_name__icontains=word) | Q(RA_street_name__icontains=word))
+        return list(voters.order_by('last_name', 'id')[:limit])
+
+    # every match is ranked, so the best voters are found wherever they are in the table
+    qn = connection.ops.quote_name
+    return list(Voter.objects.raw(
+        f'SELECT voter.* FROM ('
+        f'SELECT rowid, rank FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s ORDER BY rank LIMIT %s'
+        f') AS matches JOIN {qn(Voter._meta.db_table)} AS voter ON voter.{qn(Voter._meta.pk.column)} = matches.rowid '
+        f'ORDER BY matches.rank',
+        [match_expression(query), limit],
+    ))
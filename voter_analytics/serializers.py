@@ -0,0 +1,17 @@
+# file: voter_analytics/serializers.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: converts voter records to a text-representation suitable to transmit over HTTP
+
+from rest_framework import serializers
+from .models import Voter
+
+class VoterSerializer(serializers.ModelSerializer):
+    '''
+        A serializer for the Voter model, with the same columns as the voter files and exports
+    '''
+
+    class Meta:
+        model = Voter
+        fields = ['id', 'voter_id', 'last_name', 'first_name', 'RA_street_num', 'RA_street_name', 'RA_apt_num',
+                  'RA_zip', 'date_of_birth', 'date_of_res', 'party_affiliation', 'precinct_num',
+                  'v20state', 'v21town', 'v21primary', 'v22general', 'v23town', 'voter_score']
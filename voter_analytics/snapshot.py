@@ -0,0 +1,132 @@
+# file: voter_analytics/snapshot.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: optional in-memory, columnar copy of the voters used to answer the graphs with NumPy
+
+import logging
+import threading
+from array import array
+
+# numpy is optional and only imported once the NumPy engine is used; the graphs fall back to SQL without it
+np = None
+
+from django.conf import settings
+
+from .caching import get_generation
+from .models import Voter, ELECTION_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_enabled():
+    '''Return True if the NumPy engine was selected in the settings and numpy is installed'''
+    global np
+
+    if getattr(settings, 'VOTER_ANALYTICS_ENGINE', 'sql') != 'numpy':
+        return False
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+class VoterSnapshot:
+    '''Columns of the Voter table needed by the graphs, held as NumPy arrays for one import generation'''
+
+    def __init__(self, generation):
+        '''Load the party, birth year, participation and voter score of every voter'''
+        self.generation = generation
+
+        # parties are stored as small integer codes into self.parties
+        self.parties = []
+        party_codes = {}
+        codes = array('h')
+        birth_years = array('h')
+        participation = array('B')
+        voter_scores = array('b')
+
+        columns = Voter.objects.values_list('party_affiliation', 'birth_year', 'participation', 'voter_score')
+        for party, birth_year, voted, voter_score in columns.iterator(chunk_size=20000):
+            if party not in party_codes:
+                party_codes[party] = len(self.parties)
+                self.parties.append(party)
+            codes.append(party_codes[party])
+            birth_years.append(birth_year)
+            participation.append(voted)
+            voter_scores.append(voter_score)
+
+        self.party_codes = party_codes
+        self.party = np.frombuffer(codes, dtype=np.int16)
+        self.birth_year = np.frombuffer(birth_years, dtype=np.int16)
+        self.participation = np.frombuffer(participation, dtype=np.uint8)
+        self.voter_score = np.frombuffer(voter_scores, dtype=np.int8)
+
+        logger.info('Loaded voter snapshot of %d voters using %d bytes', len(self.party), self.nbytes)
+
+    @property
+    def nbytes(self):
+        '''Return the memory used by the arrays of this snapshot'''
+        return self.party.nbytes + self.birth_year.nbytes + self.participation.nbytes + self.voter_score.nbytes
+
+    def filter_mask(self, party=None, min_year=None, max_year=None, voter_score=None, elections=()):
+        '''Return a boolean array selecting the voters that match the filters of the graphs page'''
+        mask = np.ones(len(self.party), dtype=bool)
+
+        if party:
+            if party not in self.party_codes:
+                return np.zeros(len(self.party), dtype=bool)
+            mask &= self.party == self.party_codes[party]
+        if min_year is not None:
+            mask &= self.birth_year >= min_year
+        if max_year is not None:
+            mask &= self.birth_year <= max_year
+        if voter_score is not None:
+            mask &= self.voter_score == voter_score
+        if elections:
+            required = sum(1 << ELECTION_FIELDS.index(name) for name in elections)
+            mask &= (self.participation & required) == required
+
+        return mask
+
+    def graph_counts(self, **filters):
+        '''Return (year_counts, party_counts, election_counts) dicts for the voters matching the filters'''
+        mask = self.filter_mask(**filters)
+
+        year_counts = {}
+        years = self.birth_year[mask]
+        if len(years):
+            first_year = int(years.min())
+            for offset, count in enumerate(np.bincount(years - first_year)):
+                if count:
+                    year_counts[first_year + offset] = int(count)
+
+        party_counts = {}
+        for code, count in enumerate(np.bincount(self.party[mask], minlength=len(self.parties))):
+            if count:
+                party_counts[self.parties[code]] = int(count)
+
+        # count voters per participation bitmask, then add each bitmask to the elections it contains
+        patterns = np.bincount(self.participation[mask], minlength=1 << len(ELECTION_FIELDS))
+        election_counts = {}
+        for bit, name in enumerate(ELECTION_FIELDS):
+            election_counts[name] = int(patterns[[value for value in range(len(patterns)) if value & (1 << bit)]].sum())
+
+        return year_counts, party_counts, election_counts
+
+
+# the snapshot of the current process, replaced when the import generation changes
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    '''Return the voter snapshot for the current import generation, loading it if needed'''
+    global _snapshot
+
+    generation = get_generation()
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.generation != generation:
+            _snapshot = VoterSnapshot(generation)
+        return _snapshot
@@ -0,0 +1,112 @@
+# file: voter_analytics/synthetic.py
+# author: Ashtosh Bhandari ashtosh@bu.edu
+# description: deterministic generator of synthetic voter CSV files shaped like the Newton voter file
+
+import csv
+import random
+from datetime import date, timedelta
+
+from .models import ELECTION_FIELDS
+
+# header of the voter CSV files, in the column order parse_row expects
+CSV_HEADER = [
+    'Voter ID Number', 'Last Name', 'First Name',
+    'Residential Address - Street Number', 'Residential Address - Street Name',
+    'Residential Address - Apartment Number', 'Residential Address - Zip Code',
+    'Date of Birth', 'Date of Registration', 'Party Affiliation', 'Precinct Number',
+] + ELECTION_FIELDS + ['voter_score']
+
+# party codes as they appear in the voter file (padded to two characters) and their share of voters
+PARTIES = [('U ', 57), ('D ', 32), ('R ', 8), ('J ', 1), ('L ', 1), ('CC', 0.5), ('G ', 0.5)]
+
+# 8 wards of 4 precincts each
+PRECINCTS = [f'{ward}{letter}' for ward in range(1, 9) for letter in 'ABCD']
+
+ZIP_CODES = ['02458', '02459', '02460', '02461', '02462', '02464', '02465', '02466', '02467', '02468']
+
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson',
+    'Walker', 'Young', 'Allen', 'King', 'Wright', 'Scott', 'Torres', 'Nguyen', 'Hill', 'Flores',
+    'Green', 'Adams', 'Nelson', 'Baker', 'Hall', 'Rivera', 'Campbell', 'Mitchell', 'Carter', 'Roberts',
+    'Chen', 'Wang', 'Kim', 'Patel', 'Cohen', 'Murphy', 'Sullivan', 'OBrien', 'Kelly', 'McCarthy',
+]
+
+FIRST_NAMES = [
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Daniel', 'Lisa', 'Matthew', 'Nancy', 'Anthony', 'Sandra', 'Mark', 'Ashley', 'Steven', 'Emily',
+    'Andrew', 'Michelle', 'Joshua', 'Amanda', 'Kevin', 'Melissa', 'Brian', 'Rebecca', 'Ethan', 'Olivia',
+    'Noah', 'Emma', 'Liam', 'Sophia', 'Wei', 'Priya', 'Ana', 'Luis', 'Hannah', 'Samuel',
+]
+
+STREET_NAMES = [
+    'COMMONWEALTH AVE', 'WASHINGTON ST', 'BEACON ST', 'WALNUT ST', 'CENTRE ST', 'HAMMOND ST', 'BOYLSTON ST',
+    'CHESTNUT ST', 'LEXINGTON ST', 'WALTHAM ST', 'HIGHLAND ST', 'PARK ST', 'ELM ST', 'CHERRY ST', 'OAK AVE',
+    'JACKSON RD', 'LINCOLN ST', 'ADAMS ST', 'CABOT ST', 'AUBURN ST', 'CRAFTS ST', 'NEWTONVILLE AVE',
+    'LAKE AVE', 'DUDLEY RD', 'WARD ST', 'PLEASANT ST', 'RIVER ST', 'GROVE ST', 'HOMER ST', 'DORSET RD',
+]
+
+# the voter file is a snapshot taken at the end of this year
+REFERENCE_YEAR = 2024
+
+# how much more (or less) likely than usual a voter is to turn out for each election
+ELECTION_TURNOUT = {'v20state': 1.3, 'v21town': 0.6, 'v21primary': 0.5, 'v22general': 1.1, 'v23town': 0.55}
+
+
+def age_weight(age):
+    '''Relative number of registered voters of the given age: flat until 65, then tapering off by 100'''
+    if age <= 65:
+        return 1.0
+    return max(0.0, (100 - age) / 35)
+
+
+def generate_rows(num_rows, seed=412):
+    '''Yield num_rows lists of CSV fields for synthetic voters; the same seed always gives the same rows'''
+    rng = random.Random(seed)
+
+    parties, party_weights = zip(*PARTIES)
+    ages = list(range(18, 101))
+    age_weights = [age_weight(age) for age in ages]
+    end_of_year = date(REFERENCE_YEAR, 12, 31)
+    streets = [(name, ZIP_CODES[i % len(ZIP_CODES)], PRECINCTS[i % len(PRECINCTS)]) for i, name in enumerate(STREET_NAMES)]
+
+    for i in range(num_rows):
+        age = rng.choices(ages, age_weights)[0]
+        date_of_birth = date(REFERENCE_YEAR - age, 1, 1) + timedelta(days=rng.randrange(365))
+        eligible = date_of_birth + timedelta(days=round(18 * 365.25))
+        registered = eligible + timedelta(days=rng.randrange(max(1, (end_of_year - eligible).days)))
+
+        # most streets sit in one precinct, but a few voters of every street live across the line
+        street, zip_code, precinct = rng.choice(streets)
+        if rng.random() < 0.1:
+            precinct = rng.choice(PRECINCTS)
+
+        # a voter's habit of voting grows with age; each election then scales it by its usual turnout
+        propensity = min(1.0, rng.betavariate(2, 2) * (0.6 + age / 100))
+        voted = [rng.random() < min(1.0, propensity * ELECTION_TURNOUT[name]) for name in ELECTION_FIELDS]
+
+        yield [
+            f'NV{i:08d}',
+            rng.choice(LAST_NAMES),
+            rng.choice(FIRST_NAMES),
+            str(rng.randint(1, 400)),
+            street,
+            rng.choice(['', '', '', '', '1', '2', '3', '2B']),
+            zip_code,
+            date_of_birth.isoformat(),
+            registered.isoformat(),
+            rng.choices(parties, party_weights)[0],
+            precinct,
+            *['TRUE' if participated else 'FALSE' for participated in voted],
+            str(sum(voted)),
+        ]
+
+
+def write_voter_csv(filename, num_rows, seed=412):
+    '''Write a synthetic voter CSV file with num_rows voters'''
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(generate_rows(num_rows, seed))
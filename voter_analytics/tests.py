@@ -1,6 +1,440 @@
 # file: voter_analytics/tests.py
 # author: Ashtosh Bhandari ashtosh@bu.edu
 
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from importlib.util import find_spec
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from .caching import cache, bump_generation, get_generation, mark_rollup_current, rollup_is_current
+from .filters import VoterFilter
+from .graphs import popular_filters, record_graph_request
+from .ingest import iter_rows, parse_range, split_ranges
+from .models import Voter
+from .search import rebuild_search_index, search_voters
+from .synthetic import CSV_HEADER, write_voter_csv
+from .views import EXPORT_FIELDS, VoterListView, encode_cursor
 
 # Create your tests here.
+
+# caches used by the tests, so the shared voter_analytics file cache is left alone
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'voter_analytics': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'voter-tests'},
+}
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'query plans are checked with SQLite EXPLAIN QUERY PLAN')
+class VoterFilterQueryPlanTests(TestCase):
+    '''Check that the common voter filter combinations are answered with an index instead of a table scan'''
+
+    # query strings of the filter combinations the indexes on Voter are meant to serve
+    FILTERS = [
+        'party_affiliation=D',
+        'party_affiliation=D&voter_score=3',
+        'voter_score=3',
+        'min_year=1950&max_year=1960',
+        'voter_score=3&min_year=1950',
+        'v20state=on',
+        'v21town=on&min_year=1980',
+        'v21primary=on&max_year=1960',
+        'v22general=on&min_year=1950&max_year=1960',
+        'v23town=on&v20state=on',
+        'party_affiliation=D&v20state=on',
+    ]
+
+    def get_plan(self, query_string):
+        '''Return the EXPLAIN QUERY PLAN output for the voter list queryset built from query_string'''
+        view = VoterListView()
+        view.request = RequestFactory().get(f'/voter_analytics/?{query_string}')
+        return view.get_queryset().explain()
+
+    def test_filters_use_an_index(self):
+        '''Every filter combination should search or scan through an index'''
+        for query_string in self.FILTERS:
+            with self.subTest(query_string):
+                plan = self.get_plan(query_string)
+                self.assertRegex(plan, r'USING (COVERING )?INDEX')
+
+
+def voter_row(voter_id, last_name, date_of_birth='1960-01-01'):
+    '''Return the CSV fields of a voter for the test files'''
+    return [voter_id, last_name, 'Ann', '1', 'Main St', '', '02459', date_of_birth, '2000-01-01', 'D ', '1',
+            *['TRUE'] * 5, '5']
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IncrementalLoadTests(TestCase):
+    '''Check that load_voters --incremental inserts, updates, keeps and deletes the right voters'''
+
+    def setUp(self):
+        '''Load voters A1 to A4'''
+        self.workdir = tempfile.mkdtemp()
+        self.load([voter_row(f'A{i}', 'Smith') for i in range(1, 5)], incremental=False)
+
+    def tearDown(self):
+        '''Remove the voter files'''
+        for name in os.listdir(self.workdir):
+            os.remove(os.path.join(self.workdir, name))
+        os.rmdir(self.workdir)
+
+    def load(self, rows, **options):
+        '''Write rows to a voter file and load it, returning the command output'''
+        filename = os.path.join(self.workdir, 'voters.csv')
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(rows)
+
+        out = io.StringIO()
+        options.setdefault('incremental', True)
+        call_command('load_voters', filename, rejects=os.path.join(self.workdir, 'rejects.csv'), stdout=out, **options)
+        return out.getvalue()
+
+    def names(self):
+        '''Return a dict of the last name of every loaded voter by voter ID'''
+        return dict(Voter.objects.values_list('voter_id', 'last_name'))
+
+    def test_indexes_rebuilt(self):
+        '''The indexes dropped for the full load in setUp are built again'''
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Voter._meta.db_table)
+        for index in Voter._meta.indexes:
+            self.assertIn(index.name, constraints)
+
+    def test_snapshot_changes(self):
+        '''A1 is unchanged, A2 is rejected, A3 changed, A4 is missing and A5 is new'''
+        snapshot = [
+            voter_row('A1', 'Smith'),
+            voter_row('A2', 'Jones', date_of_birth='1960-02-31'),
+            voter_row('A3', 'Lee'),
+            voter_row('A5', 'Park'),
+        ]
+
+        # with a rejected row nothing is deleted, and the rejected voter is kept as it was
+        output = self.load(snapshot)
+        self.assertIn('1 inserted, 1 updated, 1 unchanged, 0 deleted', output)
+        self.assertIn('Not deleting the 1 voters', output)
+        self.assertEqual(self.names(), {'A1': 'Smith', 'A2': 'Smith', 'A3': 'Lee', 'A4': 'Smith', 'A5': 'Park'})
+
+        # --allow-deletes removes the missing voter, but still not the rejected one
+        output = self.load(snapshot, allow_deletes=True)
+        self.assertIn('0 inserted, 0 updated, 3 unchanged, 1 deleted', output)
+        self.assertEqual(self.names(), {'A1': 'Smith', 'A2': 'Smith', 'A3': 'Lee', 'A5': 'Park'})
+
+    def test_snapshot_changes_parallel(self):
+        '''Rejected rows parsed by worker processes are kept too'''
+        output = self.load([voter_row('A1', 'Smith'), voter_row('A2', 'Jones', date_of_birth='1960-02-31'),
+                            voter_row('A3', 'Smith'), voter_row('A4', 'Smith')], workers=2, allow_deletes=True)
+        self.assertIn('0 inserted, 0 updated, 3 unchanged, 0 deleted', output)
+        self.assertEqual(len(self.names()), 4)
+
+    def test_large_deletion_refused(self):
+        '''A snapshot missing most of the voters deletes nothing without --allow-deletes'''
+        output = self.load([voter_row('A1', 'Smith')])
+        self.assertIn('0 deleted', output)
+        self.assertEqual(len(self.names()), 4)
+
+        output = self.load([voter_row('A1', 'Smith')], allow_deletes=True)
+        self.assertIn('3 deleted', output)
+        self.assertEqual(self.names(), {'A1': 'Smith'})
+
+    def test_voters_without_id_guarded(self):
+        '''Voters loaded without a voter ID count towards the guard, and are kept when it trips'''
+        for i in range(5):
+            Voter.objects.create(last_name='NoId', first_name='Ann', RA_street_num='1', RA_street_name='Main St',
+                                 RA_zip='02459', date_of_birth='1960-01-01', date_of_res='2000-01-01',
+                                 party_affiliation='D ', precinct_num='1', voter_score=5,
+                                 v20state=True, v21town=True, v21primary=True, v22general=True, v23town=True)
+        rows = [voter_row(f'A{i}', 'Smith') for i in range(1, 5)]
+
+        # a rejected row keeps everything
+        output = self.load(rows + [voter_row('A9', 'Bad', date_of_birth='1960-02-31')])
+        self.assertIn('0 deleted', output)
+        self.assertIn('Not deleting the 5 voters', output)
+        self.assertEqual(Voter.objects.filter(voter_id__isnull=True).count(), 5)
+
+        # without rejects, 5 of 9 voters is more than the guard allows
+        output = self.load(rows)
+        self.assertIn('0 deleted', output)
+        self.assertEqual(Voter.objects.count(), 9)
+
+        output = self.load(rows, allow_deletes=True)
+        self.assertIn('5 deleted', output)
+        self.assertEqual(Voter.objects.count(), 4)
+
+    @mock.patch('voter_analytics.management.commands.load_voters.MAX_REINDEX_FRACTION', 1)
+    def test_search_index_follows_changes(self):
+        '''Only the inserted, updated and deleted voters are reindexed, and a snapshot that
+        changes nothing keeps the import generation'''
+        rows = [voter_row('A1', 'Smith'), voter_row('A2', 'Lee'), voter_row('A3', 'Smith'), voter_row('A5', 'Park')]
+        self.load(rows, allow_deletes=True)
+        found = lambda query: sorted(voter.voter_id for voter in search_voters(query))
+        self.assertEqual(found('smith'), ['A1', 'A3'])
+        self.assertEqual(found('lee'), ['A2'])
+        self.assertEqual(found('park'), ['A5'])
+
+        generation = get_generation()
+        output = self.load(rows)
+        self.assertIn('0 inserted, 0 updated, 4 unchanged, 0 deleted', output)
+        self.assertEqual(get_generation(), generation)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ImportGenerationTests(TestCase):
+    '''Check that the import generation and the rollup marker survive the cache losing them'''
+
+    def test_generation_survives_cache_clear(self):
+        '''A culled or cleared cache reads the generation back from the database'''
+        bump_generation()
+        generation = get_generation()
+        cache.clear()
+        self.assertEqual(get_generation(), generation)
+
+        bump_generation()
+        self.assertNotEqual(get_generation(), generation)
+
+    def test_rollup_marker_survives_cache_clear(self):
+        '''The rollup stays in use after the cache is cleared, until the next generation starts'''
+        bump_generation()
+        self.assertFalse(rollup_is_current())
+
+        mark_rollup_current()
+        cache.clear()
+        self.assertTrue(rollup_is_current())
+
+        bump_generation()
+        self.assertFalse(rollup_is_current())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class KeysetCursorTests(TestCase):
+    '''Check that malformed keyset cursors are ignored rather than reaching the query'''
+
+    def test_malformed_cursors(self):
+        '''Cursors with values of the wrong type or number show the first page'''
+        for cursor in [['abc'], [True], [1, 'Smith'], ['Smith'], {'id': 1}]:
+            for order in ['id', 'last_name']:
+                with self.subTest(cursor=cursor, order=order):
+                    response = self.client.get(reverse('voters'), {'paging': 'keyset', 'order': order,
+                                                                   'cursor': encode_cursor(cursor)})
+                    self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GraphPopularityTests(TestCase):
+    '''Check that graph requests are counted per filter set and ranked for warming'''
+
+    def test_popular_filters(self):
+        '''The unfiltered dashboard comes first, then the filter sets by number of requests'''
+        for query_string, requests in [('party_affiliation=D+', 3), ('min_year=1950', 5), ('voter_score=3', 1)]:
+            for i in range(requests):
+                record_graph_request(VoterFilter(QueryDict(query_string)))
+
+        self.assertEqual([voter_filter.query_string() for voter_filter in popular_filters(3)],
+                         ['', 'min_year=1950', 'party_affiliation=D+'])
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'the search table needs SQLite FTS5')
+@override_settings(CACHES=TEST_CACHES)
+class VoterSearchTests(TestCase):
+    '''Check that voters are found by the start of any word of their name or address, best matches first'''
+
+    def setUp(self):
+        '''Create 30 voters on Walnut St, then one named Walnut living there, and index them'''
+        for i in range(30):
+            self.add_voter(f'Smith{i}', 'Ann', 'Walnut St')
+        self.add_voter('Walnut', 'Ben', 'Walnut St')
+        self.add_voter('Jones', 'Sam', 'Beacon St')
+        rebuild_search_index()
+
+    def add_voter(self, last_name, first_name, street):
+        '''Create a voter with the given name and street'''
+        Voter.objects.create(last_name=last_name, first_name=first_name, RA_street_num='1', RA_street_name=street,
+                             RA_zip='02459', date_of_birth='1960-01-01', date_of_res='2000-01-01',
+                             party_affiliation='D ', precinct_num='1', voter_score=5,
+                             v20state=True, v21town=True, v21primary=True, v22general=True, v23town=True)
+
+    def test_prefixes(self):
+        '''Every word of the query must start a word of the name or address'''
+        self.assertEqual([voter.last_name for voter in search_voters('jon bea')], ['Jones'])
+        self.assertEqual([voter.last_name for voter in search_voters('sam b')], ['Jones'])
+        self.assertEqual(len(search_voters('smith1', limit=100)), 11)
+
+    def test_one_letter(self):
+        '''A query of single letters finds nothing instead of ranking the whole town'''
+        self.assertEqual(search_voters('s'), [])
+        self.assertEqual(search_voters('a b'), [])
+        self.assertContains(self.client.get(reverse('voter_search'), {'q': 's'}), 'Type at least 2 letters')
+
+    def test_best_match_first(self):
+        '''The voter matching in both name and address wins, though 30 voters were indexed before it'''
+        voters = search_voters('walnut', limit=5)
+        self.assertEqual(len(voters), 5)
+        self.assertEqual(voters[0].last_name, 'Walnut')
+
+    def test_api(self):
+        '''The API returns the matching voters as JSON, and nothing for one letter'''
+        response = self.client.get(reverse('voter_search_api'), {'q': 'jones'})
+        self.assertEqual([voter['last_name'] for voter in response.json()], ['Jones'])
+        self.assertEqual(self.client.get(reverse('voter_search_api'), {'q': 'j'}).json(), [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ConditionalAPITests(TestCase):
+    '''Check that the analytics API answers conditional GETs until the next import'''
+
+    def test_not_modified_until_import(self):
+        '''A matching If-None-Match gets a 304, and after an import the ETag changes'''
+        bump_generation()
+        url = reverse('precincts_api')
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        bump_generation()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class VoterExportTests(TestCase):
+    '''Check the columns, values and filtering of the CSV and NDJSON exports'''
+
+    def setUp(self):
+        '''Create a Democrat who voted in every election and a Republican who voted in none'''
+        for voter_id, party, voted in [('D1', 'D ', True), ('R1', 'R ', False)]:
+            Voter.objects.create(voter_id=voter_id, last_name='Smith', first_name='Ann', RA_street_num='1',
+                                 RA_street_name='Main St', RA_zip='02459', date_of_birth='1960-01-01',
+                                 date_of_res='2000-01-01', party_affiliation=party, precinct_num='1', voter_score=5,
+                                 v20state=voted, v21town=voted, v21primary=voted, v22general=voted, v23town=voted)
+
+    def export(self, export_format, query=''):
+        '''Return the body of an export of the voters matching the query string'''
+        response = self.client.get(f'{reverse("voter_export")}?format={export_format}&{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        '''The CSV starts with the export columns and writes booleans like the voter files'''
+        rows = list(csv.reader(io.StringIO(self.export('csv'))))
+        self.assertEqual(rows[0], EXPORT_FIELDS)
+        self.assertEqual([row[0] for row in rows[1:]], ['D1', 'R1'])
+        self.assertEqual(rows[1][EXPORT_FIELDS.index('v20state')], 'TRUE')
+        self.assertEqual(rows[2][EXPORT_FIELDS.index('v20state')], 'FALSE')
+        self.assertEqual(rows[1][EXPORT_FIELDS.index('date_of_birth')], '1960-01-01')
+
+    def test_ndjson(self):
+        '''The NDJSON has one object per filtered voter'''
+        voters = [json.loads(line) for line in self.export('ndjson', 'party_affiliation=D+').splitlines()]
+        self.assertEqual(len(voters), 1)
+        self.assertEqual(list(voters[0]), EXPORT_FIELDS)
+        self.assertEqual((voters[0]['voter_id'], voters[0]['v20state'], voters[0]['date_of_birth']),
+                         ('D1', True, '1960-01-01'))
+
+    def test_unknown_format(self):
+        '''Formats other than csv and ndjson are not found'''
+        self.assertEqual(self.client.get(reverse('voter_export'), {'format': 'xml'}).status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GraphEngineTests(TestCase):
+    '''Check that the SQL, rollup and NumPy engines count the graphs the same way'''
+
+    # filter sets compared across the engines
+    FILTERS = [
+        '',
+        'party_affiliation=D+',
+        'min_year=1950&max_year=1970',
+        'voter_score=3&v20state=on',
+        'party_affiliation=U+&v21town=on&v22general=on',
+    ]
+
+    def setUp(self):
+        '''Load 500 synthetic voters, which also rebuilds the rollup'''
+        workdir = tempfile.mkdtemp()
+        filename = os.path.join(workdir, 'voters.csv')
+        write_voter_csv(filename, 500)
+        call_command('load_voters', filename, rejects=os.path.join(workdir, 'rejects.csv'), stdout=io.StringIO())
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    def counts(self, query_string):
+        '''Return the graph counts of a filter set, bypassing the cache'''
+        return VoterFilter(QueryDict(query_string)).compute_graph_counts()
+
+    def voter_counts(self):
+        '''Return the SQL counts of the voters themselves for every filter set; a new generation
+        without a rollup rebuild stops the rollup from answering'''
+        bump_generation()
+        self.assertFalse(rollup_is_current())
+        return [self.counts(query_string) for query_string in self.FILTERS]
+
+    def test_rollup_matches_voters(self):
+        '''The rollup counts equal the counts of the voters themselves'''
+        self.assertTrue(rollup_is_current())
+        rollup = [self.counts(query_string) for query_string in self.FILTERS]
+        voters = self.voter_counts()
+        self.assertEqual(rollup, voters)
+        self.assertEqual(sum(voters[0][1].values()), 500)
+
+    @unittest.skipUnless(find_spec('numpy'), 'the NumPy engine needs numpy')
+    @override_settings(VOTER_ANALYTICS_ENGINE='numpy')
+    def test_numpy_matches_voters(self):
+        '''The NumPy counts equal the counts of the voters themselves'''
+        numpy_counts = [self.counts(query_string) for query_string in self.FILTERS]
+        with override_settings(VOTER_ANALYTICS_ENGINE='sql'):
+            self.assertEqual(numpy_counts, self.voter_counts())
+
+
+class ParseRangeTests(unittest.TestCase):
+    '''Check that parsing a voter file in byte ranges gives the same rows and rejects as reading it whole'''
+
+    def setUp(self):
+        '''Write a voter file with quoted newlines and line separators inside fields, and a bad row'''
+        handle, self.filename = tempfile.mkstemp(suffix='.csv')
+        rows = [
+            ['A1', 'Smith', 'Ann', '1', 'Main St', '', '02459', '1960-01-01', '2000-01-01', 'D ', '1', *['TRUE'] * 5, '5'],
+            ['A2', 'Jones', 'Bob', '2', 'Elm St', 'Apt\n2', '02459', '1961-01-01', '2000-01-01', 'R ', '2', *['FALSE'] * 5, '0'],
+            ['A3', 'Lee', 'Cy ', '3', 'Oak\x1cSt', '', '02459', '1960-02-31', '2000-01-01', 'U ', '3', *['TRUE'] * 5, '5'],
+            ['A4', 'Park', 'Di\x85', '4', 'Pine "St"', '', '02459', '1962-01-01', '2000-01-01', 'D ', '4', *['TRUE'] * 5, '5'],
+        ]
+        with os.fdopen(handle, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(rows)
+
+    def tearDown(self):
+        '''Remove the voter file'''
+        os.remove(self.filename)
+
+    def test_ranges_match_serial_parse(self):
+        '''Tiny ranges that would end inside the quoted newline still give the serial rows and rejects'''
+        with open(self.filename, encoding='utf-8', newline='') as f:
+            f.readline()
+            serial = list(iter_rows(f))
+
+        rows = []
+        rejects = []
+        lines_before = 1
+        for start, end in split_ranges(self.filename, 1):
+            range_rows, range_rejects, num_lines = parse_range(self.filename, start, end)
+            rows += range_rows
+            rejects += [(lines_before + line, error) for line, error, fields in range_rejects]
+            lines_before += num_lines
+
+        self.assertEqual(rows, [values for line, fields, values, error in serial if not error])
+        self.assertEqual(rejects, [(line, error) for line, fields, values, error in serial if error])
+        self.assertEqual(rejects[0][0], 5)
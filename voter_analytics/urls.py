@@ -8,6 +8,16 @@ from .views import *
 urlpatterns = [
 
     path('', VoterListView.as_view(), name='voters'), # List view to shows all voters with filtering
+    path('export', VoterExportView.as_view(), name='voter_export'), # Download the filtered voters as CSV or NDJSON
     path('voter/<int:pk>', VoterDetailView.as_view(), name='voter'), # Detail view to shows a single voter
+    path('search', VoterSearchView.as_view(), name='voter_search'), # Search voters by name or address
     path('graphs', GraphsView.as_view(), name='graphs'), # Graphs view to show data visualizations
+    path('precincts', PrecinctsView.as_view(), name='precincts'), # Precinct dashboard with turnout and party mix
+    path('api/precincts', PrecinctsAPIView.as_view(), name='precincts_api'), # the same precinct statistics as JSON
+    path('api/voters', VoterListAPIView.as_view(), name='voters_api'), # a page of the filtered voters as JSON
+    path('api/search', VoterSearchAPIView.as_view(), name='voter_search_api'), # best matching voters as JSON
+    path('api/birth_years', BirthYearsAPIView.as_view(), name='birth_years_api'), # filtered voters per birth year
+    path('api/parties', PartiesAPIView.as_view(), name='parties_api'), # filtered voters per party
+    path('api/participation', ParticipationAPIView.as_view(), name='participation_api'), # filtered voters per election
+    path('plotly-<str:version>.min.js', PlotlyJSView.as_view(), name='plotly_js'), # plotly.js bundle used by the graphs page
 ]
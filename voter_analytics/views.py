@@ -2,114 +2,233 @@
 # author: Ashtosh Bhandari ashtosh@bu.edu
 # description: the controller for voter_analytics applicaitons
 
-from django.views.generic import ListView, DetailView
-from .models import Voter
-import plotly
-import plotly.graph_objs as go
+from django.views.generic import ListView, DetailView, TemplateView, View
+from rest_framework import generics
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django.db.models import Q
+from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
+from django.views.decorators.http import condition
+from .models import Voter, ELECTION_FIELDS
+from .caching import get_facets, get_generation, get_precinct_stats
+from .filters import VoterFilter
+from .graphs import get_figures, plotlyjs_version, record_graph_request
+from .search import SEARCH_MIN_LENGTH, search_voters, searchable
+from .serializers import VoterSerializer
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from importlib import resources
+import csv
+import hashlib
+import io
+import json
 
 # Create your views here.
 
-class VoterListView(ListView):
-    '''View to display a list of voters with filtering options'''
+# sort keys available in keyset pagination mode; each ends with id so the order is total
+KEYSET_ORDERS = {
+    'id': ['id'],
+    'last_name': ['last_name', 'id'],
+}
+
+# type of the value each keyset sort field has in a cursor
+KEYSET_FIELD_TYPES = {
+    'id': int,
+    'last_name': str,
+}
+
+def encode_cursor(values):
+    '''Encode the sort key of the last voter on a page as an opaque query string value'''
+    return urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    '''Decode a cursor made by encode_cursor, returning None if it is malformed'''
+    try:
+        return json.loads(urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+
+
+class CountedPaginator(Paginator):
+    '''Paginator that gets the number of objects from a function, such as a cached count,
+    instead of running COUNT(*) on the queryset itself'''
+
+    def __init__(self, object_list, per_page, count_objects, **kwargs):
+        '''Remember the function returning the number of objects'''
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_objects = count_objects
+
+    @cached_property
+    def count(self):
+        '''Return the number of objects across all pages'''
+        return self.count_objects()
+
+
+class VoterFilterMixin:
+    '''Mixin for the views filtering voters with the voter form; the filters of the request
+    are parsed once into a VoterFilter, which builds the queryset and caches its results'''
+
+    @cached_property
+    def voter_filter(self):
+        '''Return the VoterFilter for the query parameters of the request'''
+        return VoterFilter(self.request.GET)
+
+    def get_queryset(self):
+        '''Return the voters matching the filters of the request'''
+        return self.voter_filter.queryset
+
+    def get_context_data(self, **kwargs):
+        '''Add the choices of the filter form and the filter values selected'''
+        context = super().get_context_data(**kwargs)
+
+        # Choices for the party, birth year and voter score dropdowns, cached until the next import
+        context.update(get_facets())
+
+        # Preserve filter values in context
+        context.update(self.voter_filter.selected_context())
+        return context
+
+
+class VoterListView(VoterFilterMixin, ListView):
+    '''View to display a list of voters with filtering options.
+    Pages use Django's offset paginator unless ?paging=keyset is given, in which case each page
+    seeks past a cursor on the sort key (?order=id or ?order=last_name), so deep pages cost
+    the same as the first one. Either way the total is counted once per filter set and import.'''
   
     model = Voter
     template_name = 'voter_analytics/voter_list.html'
     context_object_name = 'voters'
     paginate_by = 100
 
-    def get_queryset(self):
-        '''Filter the queryset based on form inputs'''
-        
-        queryset = Voter.objects.all()
-
-        # Get filter parameters from GET request
-        party = self.request.GET.get('party_affiliation')
-        min_year = self.request.GET.get('min_year')
-        max_year = self.request.GET.get('max_year')
-        voter_score = self.request.GET.get('voter_score')
-
-        # Election filters
-        v20state = self.request.GET.get('v20state')
-        v21town = self.request.GET.get('v21town')
-        v21primary = self.request.GET.get('v21primary')
-        v22general = self.request.GET.get('v22general')
-        v23town = self.request.GET.get('v23town')
-
-        # Apply filters
-        if party:
-            queryset = queryset.filter(party_affiliation=party)
-
-        if min_year:
-            queryset = queryset.filter(date_of_birth__year__gte=min_year)
-
-        if max_year:
-            queryset = queryset.filter(date_of_birth__year__lte=max_year)
-
-        if voter_score:
-            queryset = queryset.filter(voter_score=voter_score)
-
-        # Filter by elections
-        if v20state:
-            queryset = queryset.filter(v20state=True)
-        if v21town:
-            queryset = queryset.filter(v21town=True)
-        if v21primary:
-            queryset = queryset.filter(v21primary=True)
-        if v22general:
-            queryset = queryset.filter(v22general=True)
-        if v23town:
-            queryset = queryset.filter(v23town=True)
-
-        return queryset
+    def get_paginate_by(self, queryset):
+        '''Only use the offset paginator when keyset pagination was not requested'''
+        if self.request.GET.get('paging') == 'keyset':
+            return None
+        return self.paginate_by
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        '''Return a paginator that takes the number of voters from the cached count of the filters'''
+        return CountedPaginator(queryset, per_page, self.voter_filter.count, **kwargs)
+
+    def get_keyset_order(self):
+        '''Return the name of the keyset sort order requested, defaulting to id'''
+        order = self.request.GET.get('order')
+        if order not in KEYSET_ORDERS:
+            return 'id'
+        return order
+
+    def get_keyset_page(self, queryset):
+        '''Return (voters, next_cursor) for the page of the queryset after the cursor in the request'''
+        order = self.get_keyset_order()
+        fields = KEYSET_ORDERS[order]
+
+        # seek past the last voter of the previous page instead of counting an OFFSET
+        # a cursor that doesn't hold one value of the right type per field is treated as missing
+        cursor = decode_cursor(self.request.GET.get('cursor', ''))
+        if (isinstance(cursor, list) and len(cursor) == len(fields)
+                and all(type(value) is KEYSET_FIELD_TYPES[field] for value, field in zip(cursor, fields))):
+            if order == 'last_name':
+                last_name, pk = cursor
+                queryset = queryset.filter(Q(last_name__gt=last_name) | Q(last_name=last_name, id__gt=pk))
+            else:
+                queryset = queryset.filter(id__gt=cursor[0])
+
+        # fetch one extra voter to know whether there is a next page
+        voters = list(queryset.order_by(*fields)[:self.paginate_by + 1])
+        if len(voters) <= self.paginate_by:
+            return voters, None
+
+        voters = voters[:self.paginate_by]
+        return voters, encode_cursor([getattr(voters[-1], field) for field in fields])
 
     def get_context_data(self, **kwargs):
         '''Add additional context for the template'''
         context = super().get_context_data(**kwargs)
 
-        # Get distinct party affiliations for dropdown
-        context['party_affiliations'] = Voter.objects.values_list('party_affiliation', flat=True).distinct().order_by('party_affiliation')
+        if self.request.GET.get('paging') == 'keyset':
+            voters, next_cursor = self.get_keyset_page(self.object_list)
+            context['voters'] = voters
+            context['keyset'] = True
+            context['keyset_order'] = self.get_keyset_order()
 
-        # Get year range for birth dates
-        years = Voter.objects.dates('date_of_birth', 'year')
-        if years:
-            context['birth_years'] = range(years[0].year, years[len(years)-1].year + 1)
-        else:
-            context['birth_years'] = []
+            # links to the first and next pages keep the filters and the sort order
+            params = self.request.GET.copy()
+            params.pop('cursor', None)
+            context['first_page_query'] = params.urlencode()
+            if next_cursor:
+                params['cursor'] = next_cursor
+                context['next_page_query'] = params.urlencode()
 
-        # Voter scores (0-5)
-        context['voter_scores'] = range(0, 6)
+            # the total is counted once per filter set and import, then served from the cache
+            context['voter_count'] = self.voter_filter.count()
 
-        # Preserve filter values in context
-        context['selected_party'] = self.request.GET.get('party_affiliation', '')
-        
-        # Check if 'min_year' parameter exists in the GET request
-        if self.request.GET.get('min_year'):
-            min_year_value = self.request.GET.get('min_year')
-            context['selected_min_year'] = int(min_year_value)
-        else:
-            context['selected_min_year'] = ''
+        return context
 
-        # Check if 'max_year' parameter exists in the GET request
-        if self.request.GET.get('max_year'):
-            max_year_value = self.request.GET.get('max_year')
-            context['selected_max_year'] = int(max_year_value)
-        else:
-            context['selected_max_year'] = ''
 
-        # Check if 'voter_score' parameter exists in the GET request
-        if self.request.GET.get('voter_score'):
-            voter_score_value = self.request.GET.get('voter_score')
-            context['selected_voter_score'] = int(voter_score_value)
-        else:
-            context['selected_voter_score'] = ''
+# columns of an export, in the same order as the voter files we import
+EXPORT_FIELDS = [
+    'voter_id', 'last_name', 'first_name', 'RA_street_num', 'RA_street_name', 'RA_apt_num', 'RA_zip',
+    'date_of_birth', 'date_of_res', 'party_affiliation', 'precinct_num',
+] + ELECTION_FIELDS + ['voter_score']
 
-        context['selected_v20state'] = self.request.GET.get('v20state', '')
-        context['selected_v21town'] = self.request.GET.get('v21town', '')
-        context['selected_v21primary'] = self.request.GET.get('v21primary', '')
-        context['selected_v22general'] = self.request.GET.get('v22general', '')
-        context['selected_v23town'] = self.request.GET.get('v23town', '')
+# number of voters fetched from the database and sent to the client at a time
+EXPORT_CHUNK_SIZE = 2000
 
-        return context
+
+class VoterExportView(VoterListView):
+    '''View to download every voter matching the voter list filters, as CSV (?format=csv) or
+    newline-delimited JSON (?format=ndjson). Rows are streamed from a database iterator,
+    so memory use stays flat and the first bytes go out right away however many voters match.'''
+
+    def get(self, request, *args, **kwargs):
+        '''Stream the filtered voters in the requested format'''
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            raise Http404('Unknown export format')
+
+        rows = (self.get_queryset()
+                .order_by('id')
+                .values_list(*EXPORT_FIELDS)
+                .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+        if export_format == 'csv':
+            response = StreamingHttpResponse(self.csv_chunks(rows), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(self.ndjson_chunks(rows), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="voters.{export_format}"'
+        return response
+
+    def csv_chunks(self, rows):
+        '''Yield the CSV export a chunk of rows at a time, with booleans written as TRUE/FALSE like the voter files'''
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+
+        for i, row in enumerate(rows, start=1):
+            writer.writerow(['TRUE' if value is True else 'FALSE' if value is False else value for value in row])
+            if i % EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+
+    def ndjson_chunks(self, rows):
+        '''Yield the NDJSON export, one JSON object per voter, a chunk of rows at a time'''
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(dict(zip(EXPORT_FIELDS, row)), default=str))
+            if len(lines) == EXPORT_CHUNK_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+
+        if lines:
+            yield '\n'.join(lines) + '\n'
 
 
 class VoterDetailView(DetailView):
@@ -119,152 +238,157 @@ class VoterDetailView(DetailView):
     context_object_name = 'voter'
 
 
-class GraphsView(ListView):
+class VoterSearchView(TemplateView):
+    '''View to look up voters by name or address, e.g. ?q=smith walnut'''
+    template_name = 'voter_analytics/search.html'
+
+    def get_context_data(self, **kwargs):
+        '''Add the best matching voters for the search query'''
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        context['query'] = query
+        context['voters'] = search_voters(query) if query else []
+        context['too_short'] = not searchable(query)
+        context['min_length'] = SEARCH_MIN_LENGTH
+        return context
+
+
+class GraphsView(VoterFilterMixin, ListView):
     '''View to display graphs of voter data with filtering options'''
     model = Voter
     template_name = 'voter_analytics/graphs.html'
     context_object_name = 'voters'
 
-    def get_queryset(self):
-        '''Filter the queryset based on form inputs'''
-        queryset = Voter.objects.all()
-
-        # Get filter parameters from GET request
-        party = self.request.GET.get('party_affiliation')
-        min_year = self.request.GET.get('min_year')
-        max_year = self.request.GET.get('max_year')
-        voter_score = self.request.GET.get('voter_score')
-
-        # Election filters
-        v20state = self.request.GET.get('v20state')
-        v21town = self.request.GET.get('v21town')
-        v21primary = self.request.GET.get('v21primary')
-        v22general = self.request.GET.get('v22general')
-        v23town = self.request.GET.get('v23town')
-
-        # Apply filters
-        if party:
-            queryset = queryset.filter(party_affiliation=party)
-
-        if min_year:
-            queryset = queryset.filter(date_of_birth__year__gte=min_year)
-
-        if max_year:
-            queryset = queryset.filter(date_of_birth__year__lte=max_year)
-
-        if voter_score:
-            queryset = queryset.filter(voter_score=voter_score)
-
-        # Filter by elections
-        if v20state:
-            queryset = queryset.filter(v20state=True)
-        if v21town:
-            queryset = queryset.filter(v21town=True)
-        if v21primary:
-            queryset = queryset.filter(v21primary=True)
-        if v22general:
-            queryset = queryset.filter(v22general=True)
-        if v23town:
-            queryset = queryset.filter(v23town=True)
-
-        return queryset
-
     def get_context_data(self, **kwargs):
         '''Add graph data to context'''
         context = super().get_context_data(**kwargs)
 
-        # Get the filtered queryset
-        voters = self.get_queryset()
-
-        # Graph 1: Histogram of birth years
-        birth_years = [voter.date_of_birth.year for voter in voters]
-        year_counts = {}
-        for year in birth_years:
-            year_counts[year] = year_counts.get(year, 0) + 1
-
-        sorted_years = sorted(year_counts.keys())
-        year_values = [year_counts[year] for year in sorted_years]
-
-        birth_year_fig = go.Figure(data=[
-            go.Bar(x=sorted_years, y=year_values)
-        ])
-        birth_year_fig.update_layout(
-            title='Distribution of Voters by Year of Birth',
-            xaxis_title='Year of Birth',
-            yaxis_title='Number of Voters'
-        )
-        context['birth_year_graph'] = plotly.offline.plot(birth_year_fig, auto_open=False, output_type='div')
-
-        # Graph 2: Pie chart of party affiliation
-        party_counts = {}
-        for voter in voters:
-            party = voter.party_affiliation
-            party_counts[party] = party_counts.get(party, 0) + 1
-
-        party_fig = go.Figure(data=[
-            go.Pie(labels=list(party_counts.keys()), values=list(party_counts.values()))
-        ])
-        party_fig.update_layout(title='Distribution of Voters by Party Affiliation')
-        context['party_graph'] = plotly.offline.plot(party_fig, auto_open=False, output_type='div')
-
-        # Graph 3: Histogram of election participation
-        elections = {
-            'v20state': sum(1 for v in voters if v.v20state),
-            'v21town': sum(1 for v in voters if v.v21town),
-            'v21primary': sum(1 for v in voters if v.v21primary),
-            'v22general': sum(1 for v in voters if v.v22general),
-            'v23town': sum(1 for v in voters if v.v23town)
-        }
-
-        election_fig = go.Figure(data=[
-            go.Bar(x=list(elections.keys()), y=list(elections.values()))
-        ])
-        election_fig.update_layout(
-            title='Voter Participation in Elections',
-            xaxis_title='Election',
-            yaxis_title='Number of Voters'
-        )
-        context['election_graph'] = plotly.offline.plot(election_fig, auto_open=False, output_type='div')
-
-        # Add filter context data
-        context['party_affiliations'] = Voter.objects.values_list('party_affiliation', flat=True).distinct().order_by('party_affiliation')
-
-        years = Voter.objects.dates('date_of_birth', 'year')
-        if years:
-            context['birth_years'] = range(years[0].year, years[len(years)-1].year + 1)
-        else:
-            context['birth_years'] = []
+        # rendered once per filter set and import; count the request so popular filters can be warmed up
+        record_graph_request(self.voter_filter)
+        context.update(get_figures(self.voter_filter))
 
-        context['voter_scores'] = range(0, 6)
+        # the page loads plotly.js from a versioned URL and renders the specs client-side
+        context['plotly_js_version'] = plotlyjs_version()
 
-        # Preserve filter values in context
-        context['selected_party'] = self.request.GET.get('party_affiliation', '')
-        
-        # Check if 'min_year' parameter exists in the GET request
-        if self.request.GET.get('min_year'):
-            min_year_value = self.request.GET.get('min_year')
-            context['selected_min_year'] = int(min_year_value)
-        else:
-            context['selected_min_year'] = ''
+        return context
 
-        # Check if 'max_year' parameter exists in the GET request
-        if self.request.GET.get('max_year'):
-            max_year_value = self.request.GET.get('max_year')
-            context['selected_max_year'] = int(max_year_value)
-        else:
-            context['selected_max_year'] = ''
 
-        # Check if 'voter_score' parameter exists in the GET request
-        if self.request.GET.get('voter_score'):
-            voter_score_value = self.request.GET.get('voter_score')
-            context['selected_voter_score'] = int(voter_score_value)
-        else:
-            context['selected_voter_score'] = ''
+class PlotlyJSView(View):
+    '''Serve the plotly.js bundle that ships with the installed plotly package.
+    The URL carries the plotly.js version, so browsers can cache it for a year.'''
 
-        context['selected_v20state'] = self.request.GET.get('v20state', '')
-        context['selected_v21town'] = self.request.GET.get('v21town', '')
-        context['selected_v21primary'] = self.request.GET.get('v21primary', '')
-        context['selected_v22general'] = self.request.GET.get('v22general', '')
-        context['selected_v23town'] = self.request.GET.get('v23town', '')
+    def get(self, request, version):
+        '''Return the bundle if the requested version is the one installed'''
+        if version != plotlyjs_version():
+            raise Http404('Unknown plotly.js version')
 
+        bundle = resources.files('plotly') / 'package_data' / 'plotly.min.js'
+        response = FileResponse(bundle.open('rb'), content_type='application/javascript')
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+        return response
+
+
+class PrecinctsView(TemplateView):
+    '''View to display turnout, party mix and voter scores for every precinct'''
+    template_name = 'voter_analytics/precincts.html'
+
+    def get_context_data(self, **kwargs):
+        '''Add the per-precinct statistics, cached until the next import'''
+        context = super().get_context_data(**kwargs)
+        context['precincts'] = get_precinct_stats()
+        context['elections'] = ELECTION_FIELDS
         return context
+
+
+def generation_etag(request, *args, **kwargs):
+    '''Return the ETag of an analytics API response; the same URL, format and import generation
+    always return the same data'''
+    content = f'{get_generation()}|{request.get_full_path()}|{request.META.get("HTTP_ACCEPT", "")}'
+    return '"' + hashlib.md5(content.encode('utf-8')).hexdigest() + '"'
+
+
+def generation_last_modified(request, *args, **kwargs):
+    '''Return the time voters were last imported, as the Last-Modified time of an analytics API response'''
+    return datetime.fromtimestamp(get_generation(), tz=timezone.utc)
+
+
+class ConditionalAPIMixin:
+    '''Mixin for the analytics API views: responses carry an ETag and a Last-Modified time derived from
+    the import generation, and conditional GETs are answered with 304 Not Modified without touching
+    the database until the next import'''
+
+    @method_decorator(condition(etag_func=generation_etag, last_modified_func=generation_last_modified))
+    def dispatch(self, request, *args, **kwargs):
+        '''Check If-None-Match / If-Modified-Since before handling the request'''
+        return super().dispatch(request, *args, **kwargs)
+
+
+class PrecinctsAPIView(ConditionalAPIMixin, APIView):
+    '''An API view to return the turnout, party mix and voter scores of every precinct'''
+
+    def get(self, request):
+        '''Return the per-precinct statistics, cached until the next import'''
+        return Response(get_precinct_stats())
+
+
+class VoterPagination(PageNumberPagination):
+    '''Page number pagination for the voter API, with the total taken from the cached count of the filters'''
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        '''Remember how to count the voters of the view before paginating'''
+        self.count_objects = view.voter_filter.count
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        '''Return the Django paginator used for a page'''
+        return CountedPaginator(queryset, page_size, self.count_objects)
+
+
+class VoterListAPIView(ConditionalAPIMixin, VoterFilterMixin, generics.ListAPIView):
+    '''An API view to return a page of the voters matching the voter list filters'''
+    serializer_class = VoterSerializer
+    pagination_class = VoterPagination
+
+    def get_queryset(self):
+        '''Return the filtered voters in a stable order for paging'''
+        return super().get_queryset().order_by('id')
+
+
+class BirthYearsAPIView(ConditionalAPIMixin, VoterFilterMixin, APIView):
+    '''An API view to return the number of filtered voters born in each year'''
+
+    def get(self, request):
+        '''Return the birth year histogram, counted once per filter set and import'''
+        year_counts, party_counts, elections = self.voter_filter.graph_counts()
+        return Response([{'birth_year': year, 'count': count} for year, count in sorted(year_counts.items())])
+
+
+class PartiesAPIView(ConditionalAPIMixin, VoterFilterMixin, APIView):
+    '''An API view to return the number of filtered voters in each party'''
+
+    def get(self, request):
+        '''Return the party breakdown, largest party first'''
+        year_counts, party_counts, elections = self.voter_filter.graph_counts()
+        parties = sorted(party_counts.items(), key=lambda item: -item[1])
+        return Response([{'party_affiliation': party, 'count': count} for party, count in parties])
+
+
+class ParticipationAPIView(ConditionalAPIMixin, VoterFilterMixin, APIView):
+    '''An API view to return the number of filtered voters who participated in each election'''
+
+    def get(self, request):
+        '''Return the participation counts, in the order of the elections'''
+        year_counts, party_counts, elections = self.voter_filter.graph_counts()
+        return Response([{'election': name, 'count': count} for name, count in elections.items()])
+
+
+class VoterSearchAPIView(ConditionalAPIMixin, APIView):
+    '''An API view to return the best matching voters for a search box, e.g. ?q=smi'''
+
+    def get(self, request):
+        '''Return up to SEARCH_LIMIT voters whose name or address start with the words of the query'''
+        voters = search_voters(request.GET.get('q', ''))
+        return Response(VoterSerializer(voters, many=True).data)